@@ -1,107 +1,663 @@
+import os
+import json
+import hashlib
+import shutil
+import subprocess
+from time import perf_counter
 from pathlib import Path
-from copy import deepcopy
+from threading import Thread, Lock
+from queue import Queue, Empty
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
 import numpy as np
-import svgutils.compose as sc
-from matplotlib import pyplot as plt
-from layout import BB84Setup, brighten
+from PIL import Image
+from layout import BB84Setup, brighten, icons
+from instrument import instrument, save_trace, summary
 
 sq2pi = np.sqrt(2*np.pi)
+# frame rate of the clips (cf. compile_clips.sh)
+CLIP_FPS = 60
 
 
-def transmission(img_base, seconds, fps,
-                 alice_detector=0, bob_detector=0,
-                 signal=0, polarisation=0):
+def state_hash(state):
+    """
+    Canonical hash of a frame state, i.e. the set_index arguments of
+    each party
+    """
+    return hashlib.sha1(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+
+def asset_fingerprint(img_base):
+    """
+    Hash of the icon assets frames are rendered from: the number of
+    detector variants and the SVG text of every asset BB84Setup loads
+    (registered in memory, see IconRegistry.add, or read from disk)
+    """
+    paths = [Path(img_base) / "alice_text.svg", Path(img_base) / "bob_text.svg"]
+    for load in (BB84Setup.load_detector_svgs, BB84Setup.load_activation_svgs,
+                 BB84Setup.load_signal_svgs):
+        for path in load(BB84Setup.icon_base).paths:
+            paths += path if isinstance(path, (list, tuple)) else [path]
+    digest = hashlib.sha1(str(BB84Setup.detector_variants).encode())
+    for path in paths:
+        text = icons.sources.get(str(path))
+        if text is not None:
+            data = text.encode()
+        elif path.exists():
+            data = path.read_bytes()
+        else:
+            data = b''
+        digest.update(str(path).encode() + b'\0' + hashlib.sha1(data).digest())
+    return digest.hexdigest()
+
+
+def frame_hash(state, draft=1, assets=None):
+    """
+    Hash of a rendered frame: its state, for drafts the draft factor,
+    and the fingerprint of the assets (see asset_fingerprint)
+    """
+    key = dict(state)
+    if draft != 1:
+        key['draft'] = draft
+    if assets is not None:
+        key['assets'] = assets
+    return state_hash(key)
+
+
+def frame_layout(img_base, state, draft=1):
+    """
+    The layout of a single frame, fully determined by its state (and
+    the draft factor, see BB84Setup)
+    """
+    layout = BB84Setup(head_icons=[icons.get(img_base/"alice_text.svg"),
+                                   icons.get(img_base/"bob_text.svg")],
+                       draft=draft)
+    for party, kwargs in state.items():
+        layout.set_index(party, **kwargs)
+    return layout
+
+
+class FrameWriter:
+    """
+    Compress and write PNG frames on background threads fed by a bounded
+    queue, so that rendering the next frame overlaps encoding this one
+
+    Frames are written atomically (through a temporary file); written
+    frame buffers are recycled through buffer().
+
+    Args:
+      workers (int): number of encoder threads
+      maxsize (int): number of frames waiting to be encoded
+      compress_level (int): zlib compression level of the PNGs
+    """
+    def __init__(self, workers=2, maxsize=4, compress_level=6):
+        self.compress_level = compress_level
+        self.queue = Queue(maxsize)
+        self.free = Queue()
+        self.lock = Lock()
+        self.error = None
+        self.stall = 0.
+        self.encode = 0.
+        self.written = 0
+        self.max_depth = 0
+        self.closed = False
+        self.threads = [Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def buffer(self):
+        """
+        A written frame buffer for reuse, None if there is none yet
+        """
+        try:
+            return self.free.get_nowait()
+        except Empty:
+            return None
+
+    def put(self, filename, frame):
+        """
+        Queue a frame for writing; blocks while the queue is full
+        """
+        if self.error is not None:
+            raise self.error
+        start = perf_counter()
+        self.queue.put((Path(filename), frame))
+        self.stall += perf_counter() - start
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def run(self):
+        while (item := self.queue.get()) is not None:
+            filename, frame = item
+            start = perf_counter()
+            try:
+                with instrument.span('write'):
+                    tmp = filename.with_name(filename.name + '.tmp')
+                    Image.fromarray(frame).save(tmp, format='PNG',
+                                                compress_level=self.compress_level)
+                    os.replace(tmp, filename)
+            except Exception as e:
+                self.error = e
+            with self.lock:
+                self.encode += perf_counter() - start
+                self.written += 1
+            self.free.put(frame)
+
+    def stats(self):
+        """
+        Queue depth, time the producer stalled on a full queue and time
+        spent encoding (summed over threads)
+        """
+        return {'depth': self.queue.qsize(), 'max_depth': self.max_depth,
+                'stall': self.stall, 'encode': self.encode,
+                'written': self.written}
+
+    def close(self):
+        """
+        Flush the queue and stop the encoder threads; closing a closed
+        writer does nothing
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# per-process render settings, set once by init_worker
+worker = {}
+
+
+def init_worker(img_base, writers=2, queue_size=4, compress_level=6, trace=False,
+                draft=1, sources=None, detector_variants=None):
+    """
+    Initialize a render process: register the in-memory icons of the
+    parent (<sources>, see IconRegistry.add) and its number of detector
+    variants, parse the shared icons once and start its PNG writer,
+    which is flushed when the process exits; with <trace>, the render
+    stages are instrumented (see instrument.py)
+    """
+    instrument.enable(trace)
+    for path, text in (sources or {}).items():
+        if icons.sources.get(path) != text:
+            icons.add(path, text)
+    if detector_variants is not None:
+        BB84Setup.detector_variants = detector_variants
+    worker['img_base'] = Path(img_base)
+    worker['draft'] = draft
+    worker['render'] = 0.
+    worker['writer'] = FrameWriter(writers, queue_size, compress_level)
+    worker['finalize'] = Finalize(worker['writer'], worker['writer'].close,
+                                  exitpriority=10)
+    frame_layout(worker['img_base'], {}, draft)
+
+
+def render_frame(task):
+    """
+    Render a frame state; queue it for writing to <filename>, or return
+    the pixels if filename is None.  The trace events recorded since the
+    last frame are returned along with the result.
+    """
+    filename, state, digest = task
+    start = perf_counter()
+    with instrument.span('frame'):
+        layout = frame_layout(worker['img_base'], state, worker['draft'])
+        buffer = None if filename is None else worker['writer'].buffer()
+        frame = layout.render(buffer)
+    if filename is None:
+        return frame, instrument.drain()
+    worker['render'] += perf_counter() - start
+    worker['writer'].put(filename, frame)
+    stats = dict(worker['writer'].stats(), pid=os.getpid(), render=worker['render'])
+    return filename, digest, stats, instrument.drain()
+
+
+def ordered_results(pool, fn, tasks, ahead):
+    """
+    Results of fn over tasks in order, with at most <ahead> tasks
+    submitted to the pool but not yet consumed; the pool keeps working
+    while the consumer handles a result, but finished results cannot
+    pile up ahead of a slow consumer
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, task))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def writer_report(stats):
+    """
+    Summary of the PNG writers of all render processes: if rendering
+    stalls on full queues, writing (I/O or compression) is the bottleneck
+    """
+    render = sum(s['render'] for s in stats.values())
+    stall = sum(s['stall'] for s in stats.values())
+    encode = sum(s['encode'] for s in stats.values())
+    depth = max((s['max_depth'] for s in stats.values()), default=0)
+    bound = 'writing' if stall > 0.1 * render else 'rendering'
+    return (f"render {render:.1f}s, encode {encode:.1f}s, "
+            f"stalled {stall:.1f}s, max queue depth {depth}: {bound} bound")
+
+
+class FFmpegWriter:
+    """
+    Encode raw RGBA frames piped into ffmpeg's stdin, with the same
+    overlay-on-black filter and codec settings as compile_clips.sh
+
+    Args:
+      filename (str | Path): output clip
+      resolution (int, int): frame size
+      fps (int): frame rate of the clip
+      canvas (str): size of the black base canvas (default: frame size)
+    """
+    def __init__(self, filename, resolution, fps=60, canvas=None):
+        size = f"{resolution[0]}x{resolution[1]}"
+        canvas = size if canvas is None else canvas
+        self.filename = Path(filename)
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-y', '-loglevel', 'error',
+             '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', size,
+             '-framerate', str(fps), '-i', '-',
+             '-c:v', 'libx265', '-crf', '1',
+             '-filter_complex',
+             f"color=c=black:size={canvas} [base]; [base][0:v]overlay=shortest=1",
+             str(filename)],
+            stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with {self.process.returncode}")
+
+    def abort(self):
+        """
+        Stop ffmpeg and remove the truncated clip
+        """
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.filename.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def load_manifest(base):
+    manifest = Path(base) / "manifest.json"
+    if manifest.exists():
+        return json.loads(manifest.read_text())
+    return {}
+
+
+def save_manifest(base, frames):
+    manifest = Path(base) / "manifest.json"
+    tmp = manifest.with_name(manifest.name + '.tmp')
+    tmp.write_text(json.dumps(frames, indent=1, sort_keys=True))
+    os.replace(tmp, manifest)
+
+
+# content-addressed frames, shared by all scenes
+STORE = Path("frames/store")
+
+
+def store_path(store, digest):
+    """
+    File of the frame with state hash <digest> in a frame store
+    """
+    return Path(store) / digest[:2] / f"{digest}.png"
+
+
+def link_frame(source, filename):
+    """
+    Hardlink a repeated frame to the file of its first occurrence
+    (copy it where the filesystem has no hardlinks)
+    """
+    filename.unlink(missing_ok=True)
+    try:
+        os.link(source, filename)
+    except OSError:
+        shutil.copyfile(source, filename)
+
+
+def render_scene(img_base, base, states, processes=None, checkpoint=16,
+                 output='png', fps=CLIP_FPS, canvas=None, draft=1,
+                 writers=2, queue_size=4, compress_level=6, store=STORE,
+                 trace=None):
+    """
+    Render the frames of a scene on a process pool, either as a PNG
+    sequence (frame_{i:05d}.png in <base>) or streamed into ffmpeg as
+    one clip (<base name>.mp4, cf. compile_clips.sh)
+
+    Every distinct state is rendered once: PNG frames are rendered into
+    a content-addressed store shared by all scenes (see store_path) and
+    hardlinked into <base>; without a store, repeated frames are
+    hardlinked to their first occurrence.  A frame held for several
+    consecutive states is piped into ffmpeg repeatedly.
+
+    For PNG output, a manifest (manifest.json in <base>) records the
+    state hash of every finished frame; frames which exist and match
+    their manifest entry are skipped, so an interrupted render resumes
+    where it stopped.
+
+    Args:
+      img_base (Path): directory of the icon assets
+      base (Path): frame directory of the scene
+      states (list(dict)): frame states (set_index arguments per party)
+      processes (int): number of render processes (default: all cores),
+                       0 renders in the calling process
+      checkpoint (int): number of frames between manifest updates (png)
+      output (str): 'png' for a frame sequence, 'ffmpeg' for a clip
+      fps (int): frame rate of the clip (ffmpeg only)
+      canvas (str): size of the clip's black base canvas (ffmpeg only)
+      draft (float): render a draft at this fraction of the resolution
+                     into <base>.draft<factor> (see BB84Setup)
+      writers (int): PNG encoder threads per render process
+      queue_size (int): frames queued for encoding per render process
+      compress_level (int): zlib compression level of the PNGs
+      store (Path): frame store directory, None to render into <base>
+      trace (str | Path): if given, instrument the render stages, write
+                          a Chrome trace (JSON) to this file and print a
+                          summary table (writes still queued when a
+                          render process exits are not traced)
+    """
+    base = Path(base)
+    if draft != 1:
+        base = base.with_name(f"{base.name}.draft{draft:g}")
+    # new assets (e.g. more detector variants) give new digests
+    assets = asset_fingerprint(img_base)
+    digests = [frame_hash(state, draft, assets) for state in states]
+    if output == 'ffmpeg':
+        # consecutive frames with the same state are held, not re-rendered
+        holds = []
+        for i, digest in enumerate(digests):
+            if holds and digests[i-1] == digest:
+                holds[-1] += 1
+            else:
+                holds.append(1)
+        starts = np.cumsum([0] + holds[:-1])
+        tasks = [(None, states[i], digests[i]) for i in starts]
+        frames = None
+    else:
+        base.mkdir(parents=True, exist_ok=True)
+        frames = load_manifest(base)
+        filenames = [base / f"frame_{i:05d}.png" for i in range(len(states))]
+        first = {}
+        tasks = []
+        links = []
+        for filename, state, digest in zip(filenames, states, digests):
+            if filename.exists() and frames.get(filename.name) == digest:
+                if store is None:
+                    first.setdefault(digest, filename)
+                continue
+            frames.pop(filename.name, None)
+            if store is not None:
+                source = store_path(store, digest)
+                if digest not in first and not source.exists():
+                    source.parent.mkdir(parents=True, exist_ok=True)
+                    tasks.append((source, state, digest))
+                first[digest] = source
+                links.append((source, filename, digest))
+            elif digest in first:
+                links.append((first[digest], filename, digest))
+            else:
+                first[digest] = filename
+                tasks.append((filename, state, digest))
+        pending = len(links) + (len(tasks) if store is None else 0)
+        print(f"{base}: {len(states)-pending} of {len(states)} frames "
+              f"up to date, {len(tasks)} distinct states to render")
+    # spawned render processes don't inherit in-memory icons
+    initargs = (img_base, writers, queue_size, compress_level, trace is not None, draft,
+                dict(icons.sources), BB84Setup.detector_variants)
+    events = []
+    if processes == 0:
+        init_worker(*initargs)
+        results = map(render_frame, tasks)
+    else:
+        pool = ProcessPoolExecutor(processes, initializer=init_worker,
+                                   initargs=initargs)
+        if output == 'ffmpeg':
+            # raw frames are large (~35 MB at 4K): keep only two frames
+            # per process in flight
+            ahead = 2 * (processes or os.cpu_count())
+            results = ordered_results(pool, render_frame, tasks, ahead)
+        else:
+            results = pool.map(render_frame, tasks, chunksize=4)
+    try:
+        if output == 'ffmpeg':
+            writer = None
+            clip = f"{base.name}.mp4"
+            try:
+                for (frame, trace_events), hold in zip(results, holds):
+                    events += trace_events
+                    if writer is None:
+                        writer = FFmpegWriter(clip, frame.shape[1::-1], fps=fps,
+                                              canvas=canvas)
+                    for _ in range(hold):
+                        writer.write(frame)
+            except BaseException:
+                # a failed render or a dead ffmpeg leaves no truncated clip
+                if writer is not None:
+                    writer.abort()
+                raise
+            if writer is not None:
+                writer.close()
+                print(clip)
+        else:
+            stats = {}
+            for count, (filename, digest, writer, trace_events) in enumerate(results, 1):
+                print(filename)
+                events += trace_events
+                if store is None:
+                    frames[Path(filename).name] = digest
+                stats[writer['pid']] = writer
+                if count % checkpoint == 0:
+                    save_manifest(base, frames)
+            if stats:
+                print(f"{base}: {writer_report(stats)}")
+    finally:
+        if processes == 0:
+            try:
+                worker['writer'].close()
+            finally:
+                worker['finalize'].cancel()
+            events += instrument.drain()
+            instrument.enable(False)
+        else:
+            pool.shutdown(cancel_futures=True)
+        if trace is not None:
+            save_trace(trace, events)
+            print(summary(events))
+            print(trace)
+        if frames is not None:
+            # link frames once the files they point to are flushed
+            for source, filename, digest in links:
+                if source.exists() and (store is not None or
+                                        frames.get(source.name) == digest):
+                    link_frame(source, filename)
+                    frames[filename.name] = digest
+            save_manifest(base, frames)
+
+
+def draft_rate(fps, draft=1, draft_fps=None):
+    """
+    Scene and clip frame rate: drafts (draft != 1) may sample a scene at
+    a reduced <draft_fps>, with the clip rate reduced alike so that the
+    clip keeps its duration
+
+    Returns:
+      (float, float): scene fps, clip fps
+    """
+    if draft == 1 or not draft_fps:
+        return fps, CLIP_FPS
+    return draft_fps, CLIP_FPS * draft_fps / fps
+
+
+def transmission_states(seconds, fps,
+                        alice_detector=0, bob_detector=0,
+                        signal=0, polarisation=0):
     base = Path(f"frames/transmission_{alice_detector}-{bob_detector}.{signal}.{polarisation}")
-    base.mkdir(parents=True, exist_ok=True)
     t = np.linspace(0, seconds, seconds*fps)
-    head_icons = [sc.SVG(img_base/"alice_text.svg"), sc.SVG(img_base/"bob_text.svg")]
-    for i, ti in enumerate(t):
-        filename = base / f"frame_{i:05d}.png"
-        plt.axis('off')
-        plt.style.use('dark_background')
-        layout = BB84Setup(head_icons=[deepcopy(h) for h in head_icons])
+    states = []
+    for ti in t:
         ti = ti % 1
         alpha = min(1, 100 * np.exp(-0.5*(ti-0.5)**2/0.1**2) / (sq2pi*0.1))
-        print(filename)
-        layout.default_index(layout.alice_index, 'alice')
-        layout.set_index('alice', detector=alice_detector,
-                         signal=signal, signal_polarisation=polarisation,
-                         signal_alpha=alpha, signal_distance=ti)
-        layout.set_index('bob', detector=bob_detector)
-        layout.plot()
-        plt.savefig(filename, transparent=True)
-        plt.gcf().clear()
+        states.append({
+            'alice': dict(detector=alice_detector,
+                          signal=signal, signal_polarisation=polarisation,
+                          signal_alpha=float(alpha), signal_distance=float(ti)),
+            'bob': dict(detector=bob_detector)})
+    return base, states
 
-def detector_transition(img_base, seconds, fps,
-                        alice_detector=0, bob_detector=0,
-                        transition='alice'):
+
+def transmission(img_base, seconds, fps,
+                 alice_detector=0, bob_detector=0,
+                 signal=0, polarisation=0, processes=None, output='png',
+                 draft=1, draft_fps=None):
+    fps, clip_fps = draft_rate(fps, draft, draft_fps)
+    base, states = transmission_states(seconds, fps, alice_detector, bob_detector,
+                                       signal, polarisation)
+    render_scene(img_base, base, states, processes=processes, output=output,
+                 fps=clip_fps, draft=draft)
+
+
+def transition_states(seconds, fps,
+                      alice_detector=0, bob_detector=0,
+                      transition='alice'):
     if transition == 'alice':
         transition_str = f"{alice_detector}.{int(not alice_detector)}"
         base = Path(f"frames/transition_{transition_str}-{bob_detector}")
     else:
         transition_str = f"{bob_detector}.{int(not bob_detector)}"
         base = Path(f"frames/transition_{alice_detector}-{transition_str}")
-    base.mkdir(parents=True, exist_ok=True)
-    t = np.linspace(0, 29, int(seconds*fps)).astype(int)
-    for i, ti in enumerate(t):
-        filename = base / f"frame_{i:05d}.png"
-        plt.axis('off')
-        plt.style.use('dark_background')
-        layout = BB84Setup(head_icons=[sc.SVG(img_base/"alice_text.svg"),
-                                       sc.SVG(img_base/"bob_text.svg")])
-        print(filename)
+    # detectors 2, ..., n-1 are the steps of the transition
+    n = BB84Setup.detector_variants
+    t = np.linspace(0, n-3, int(seconds*fps)).astype(int)
+    states = []
+    for ti in t:
         if transition == 'alice':
-            dt = 2+ti if alice_detector == 0 else 31-ti
-            layout.set_index(transition, detector=dt)
-            layout.set_index('bob', detector=bob_detector)
+            dt = 2+ti if alice_detector == 0 else n-1-ti
+            states.append({'alice': dict(detector=int(dt)),
+                           'bob': dict(detector=bob_detector)})
         else:
-            dt = 2+ti if bob_detector == 0 else 31-ti
-            layout.set_index(transition, detector=dt)
-            layout.set_index('alice', detector=alice_detector)
-        layout.plot()
-        plt.savefig(filename, transparent=True)
-        plt.gcf().clear()
+            dt = 2+ti if bob_detector == 0 else n-1-ti
+            states.append({'bob': dict(detector=int(dt)),
+                           'alice': dict(detector=alice_detector)})
+    return base, states
 
-def detection(img_base, seconds, fps,
-              alice_detector=0, bob_detector=0,
-              activation='bob'):
+
+def detector_transition(img_base, seconds, fps,
+                        alice_detector=0, bob_detector=0,
+                        transition='alice', processes=None, output='png',
+                        draft=1, draft_fps=None):
+    fps, clip_fps = draft_rate(fps, draft, draft_fps)
+    base, states = transition_states(seconds, fps, alice_detector, bob_detector,
+                                     transition)
+    render_scene(img_base, base, states, processes=processes, output=output,
+                 fps=clip_fps, draft=draft)
+
+
+def detection_states(seconds, fps,
+                     alice_detector=0, bob_detector=0,
+                     activation='bob'):
     base = Path(f"frames/activation_{alice_detector}-{bob_detector}.{activation}")
-    base.mkdir(parents=True, exist_ok=True)
     t = np.linspace(0, seconds, int(seconds*fps))
-    for i, ti in enumerate(t):
-        filename = base / f"frame_{i:05d}.png"
-        plt.axis('off')
-        plt.style.use('dark_background')
-        layout = BB84Setup(head_icons=[sc.SVG(img_base/"alice_text.svg"),
-                                       sc.SVG(img_base/"bob_text.svg")])
-        color = getattr(layout, f'{activation}_color')
+    color = getattr(BB84Setup, f'{activation}_color')
+    states = []
+    for ti in t:
         factor = min(1, 0.1 * np.exp(-0.5*(ti-0.5)**2/0.1**2) / (sq2pi*0.1))
-        print(filename, factor, brighten(color, factor))
-        layout.set_index(activation, detector_color=brighten(color, factor))
         if activation == 'alice':
-            layout.set_index(activation, detector=alice_detector,
-                             detector_color=brighten(color, factor))
-            layout.set_index('bob', detector=bob_detector)
+            states.append({'alice': dict(detector=alice_detector,
+                                         detector_color=brighten(color, factor)),
+                           'bob': dict(detector=bob_detector)})
         else:
-            layout.set_index(activation, detector=bob_detector,
-                             detector_color=brighten(color, factor))
-            layout.set_index('alice', detector=alice_detector)
-        layout.plot()
-        plt.savefig(filename, transparent=True)
-        plt.gcf().clear()
+            states.append({'bob': dict(detector=bob_detector,
+                                       detector_color=brighten(color, factor)),
+                           'alice': dict(detector=alice_detector)})
+    return base, states
+
+
+def detection(img_base, seconds, fps,
+              alice_detector=0, bob_detector=0,
+              activation='bob', processes=None, output='png',
+              draft=1, draft_fps=None):
+    fps, clip_fps = draft_rate(fps, draft, draft_fps)
+    base, states = detection_states(seconds, fps, alice_detector, bob_detector,
+                                    activation)
+    render_scene(img_base, base, states, processes=processes, output=output,
+                 fps=clip_fps, draft=draft)
+
+
+def tally_states(seconds, fps,
+                 alice_tally, alice_bases,
+                 bob_tally, bob_bases, cells=8):
+    """
+    Frame states of tallies growing one cell at a time over <seconds>;
+    tallies longer than <cells> cells are shrunk to fit the same width
+    """
+    alice_tally, alice_bases, bob_tally, bob_bases = [
+        [int(v) for v in values] for values in (alice_tally, alice_bases, bob_tally, bob_bases)]
+    n = max(len(alice_tally), len(alice_bases), len(bob_tally), len(bob_bases))
+    digest = state_hash([alice_tally, alice_bases, bob_tally, bob_bases])[:8]
+    base = Path(f"frames/tally_{n}.{digest}")
+    fit = min(1., cells / max(n, 1))
+    t = np.linspace(0, seconds, int(seconds*fps))
+    shown = np.minimum(np.floor(t / seconds * n).astype(int) + 1, n)
+    layout = BB84Setup()
+    scaled = {}
+    for party in ('alice', 'bob'):
+        index = getattr(layout, f'{party}_index')
+        scaled[party] = {key: index[key] * fit for key in (
+            'tally_scale', 'tally_x_adjust', 'tally_bases_scale', 'tally_bases_x_adjust')
+                         } if fit < 1 else {}
+    states = []
+    for i in shown:
+        state = {}
+        for party, tally, bases in [('alice', alice_tally, alice_bases),
+                                    ('bob', bob_tally, bob_bases)]:
+            state[party] = dict(tally=tally[:i], tally_bases=bases[:i], **scaled[party])
+        states.append(state)
+    return base, states
+
 
 def tally_scenario(img_base, seconds, fps,
                    alice_tally, alice_bases,
-                   bob_tally, bob_bases):
-    pass
+                   bob_tally, bob_bases, processes=None, output='png',
+                   draft=1, draft_fps=None):
+    fps, clip_fps = draft_rate(fps, draft, draft_fps)
+    base, states = tally_states(seconds, fps, alice_tally, alice_bases,
+                                bob_tally, bob_bases)
+    render_scene(img_base, base, states, processes=processes, output=output,
+                 fps=clip_fps, draft=draft)
 
 
 if __name__ == "__main__":
     fps = 180
     seconds = 1
     img_base = Path("assets/images")
-
-    fig = plt.figure()
+    # previews: e.g. dict(draft=0.25, draft_fps=30)
+    draft = dict(draft=1, draft_fps=None)
 
     # transmissions
     if 0:
@@ -110,21 +666,29 @@ if __name__ == "__main__":
                 for i in range(2): # signal icons
                     #transmission(img_base, seconds, fps, a, b, i, 0)
                     for p in range(1, 3): # polarisation
-                        transmission(img_base, seconds, fps, a, b, i, p)
+                        transmission(img_base, seconds, fps, a, b, i, p, **draft)
 
     # transitions
     if 0:
         for a in range(2):
             for b in range(2):
                 for t in ['alice', 'bob']:
-                    detector_transition(img_base, seconds, fps/3, a, b, t)
+                    detector_transition(img_base, seconds, fps/3, a, b, t, **draft)
 
     # activation
     if 0:
         for a in range(2):
             for b in range(2):
                 for t in ['bob', 'alice']:
-                    detection(img_base, seconds, fps/3, a, b, t)
+                    detection(img_base, seconds, fps/3, a, b, t, **draft)
 
     # tally scenario
-
+    if 0:
+        rng = np.random.default_rng(84)
+        n = 16
+        alice_bases, bob_bases = rng.integers(0, 2, size=(2, n))
+        alice_tally = rng.integers(0, 2, size=n)
+        bob_tally = np.where(alice_bases == bob_bases, alice_tally,
+                             rng.integers(0, 2, size=n))
+        tally_scenario(img_base, 4, fps/3, alice_tally, alice_bases,
+                       bob_tally, bob_bases, **draft)
@@ -1,16 +1,34 @@
+from statistics import NormalDist
+from time import perf_counter
+from threading import Thread, Event
+from queue import Queue, Empty, Full
 import numpy as np
 from numpy.random import randint
-from qiskit import QuantumCircuit, Aer, transpile
-from qiskit.visualization import plot_histogram, plot_bloch_multivector
-from matplotlib import pyplot as plt
 
+# bit order of all packed keys; 'little' lets packed bytes be viewed as
+# uint64 words with bit i of the key at (word[i // 64] >> (i % 64)) & 1
+BITORDER = 'little'
 
-def bb84_encode(bits, basis):
+# basis of a maximally mixed qubit in the vectorized engine (e.g. after
+# depolarisation); measuring it gives a random bit in either basis
+MIXED = 2
+
+
+def bb84_encode(bits, basis, backend='qiskit'):
     """
     Quantum-encode a set of bits onto a set of bases:
     If the basis is 0, a qubit in the Z-basis (i.e. |1> or |0>) is prepared,
     and if the basis is 1, in the X-basis (i.e. |-> or |+>)
+
+    Args:
+      bits (array-like): bits to be encoded
+      basis (array-like): basis (0 or 1) for each bit
+      backend (str): 'qiskit' for one QuantumCircuit per bit,
+                     'numpy' for the vectorized engine (see np_encode)
     """
+    if backend == 'numpy':
+        return np_encode(bits, basis)
+    from qiskit import QuantumCircuit
     code = []
     n = len(basis)
     for i in range(n):
@@ -21,35 +39,677 @@ def bb84_encode(bits, basis):
             qc.h(0)
         else:
             if bits[i]:
-                qc.h(0)
+                qc.x(0)
         qc.barrier()
         code.append(qc)
     return code
 
 
-def measure_key(message, basis, backend=Aer.get_backend('aer_simulator')):
+def aer_simulator():
     """
+    qiskit's Aer simulator backend (qiskit is only imported when used)
     """
-    measurements = []
+    try:
+        from qiskit_aer import Aer
+    except ImportError:
+        # qiskit < 1.0
+        from qiskit import Aer
+    return Aer.get_backend('aer_simulator')
+
+
+def measure_key(message, basis, backend='qiskit', rng=None, batch_size=None):
+    """
+    Measure each qubit of a message in the given bases
+
+    Args:
+      message (list(QuantumCircuit) | np.ndarray): output of bb84_encode
+      basis (array-like): measurement basis (0 or 1) for each qubit
+      backend (Backend | str): qiskit backend, 'qiskit' for the Aer
+                               simulator, or 'numpy' for the
+                               vectorized engine (see np_measure)
+      rng (np.random.Generator | int): random generator or seed (numpy only)
+      batch_size (int): if given, submit the circuits in lists of
+                        <batch_size> per backend.run call instead of
+                        one job per qubit (qiskit only)
+
+    Note:
+      The circuits in <message> are copied before the measurement is
+      appended, i.e. the caller's circuits are left untouched
+    """
+    if isinstance(backend, str):
+        if backend == 'numpy':
+            return np_measure(message, basis, rng=rng)
+        if backend != 'qiskit':
+            raise ValueError(f"unknown backend {backend!r}, expected 'qiskit' or 'numpy'")
+        backend = aer_simulator()
     n = len(basis)
-    for q in range(n):
-        if basis[q]:
-            message[q].h(0)
-        message[q].measure(0, 0)
-        result = backend.run(message[q], shots=1, memory=True).result()
-        measured_bit = int(result.get_memory()[0])
-        measurements.append(measured_bit)
+    if batch_size is None:
+        batch_size = 1
+    measurements = []
+    for start in range(0, n, batch_size):
+        batch = [measurement_circuit(message[q], basis[q])
+                 for q in range(start, min(start+batch_size, n))]
+        result = backend.run(batch, shots=1, memory=True).result()
+        measurements += [int(result.get_memory(i)[0]) for i in range(len(batch))]
     return measurements
-        
 
-def sync_results(bits, basis_a, basis_b):
-    good_bits = []
+
+def measurement_circuit(qc, basis):
+    """
+    Copy of a single-qubit encoding with a measurement in <basis> appended
+    """
+    qc = qc.copy()
+    if basis:
+        qc.h(0)
+    qc.measure(0, 0)
+    return qc
+
+
+def np_encode(bits, basis):
+    """
+    Vectorized counterpart of bb84_encode: a BB84 qubit is fully
+    determined by its (bit, basis) pair, so a whole message is stored
+    as a (2, n) uint8 array with rows [bits, basis]
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    basis = np.asarray(basis, dtype=np.uint8)
+    if bits.shape != basis.shape:
+        raise ValueError(f"bits {bits.shape} and basis {basis.shape} differ in shape")
+    return np.stack([bits, basis])
+
+
+def np_measure(message, basis, rng=None):
+    """
+    Vectorized counterpart of measure_key: measuring in the preparation
+    basis returns the encoded bit, measuring in the conjugate basis (or
+    a MIXED qubit in any basis) returns a uniformly random bit
+
+    Args:
+      message (np.ndarray): (2, n) array from np_encode
+      basis (array-like): measurement basis (0 or 1) for each qubit
+      rng (np.random.Generator | int): random generator or seed
+    """
+    rng = np.random.default_rng(rng)
+    bits, prepared = message
+    basis = np.asarray(basis, dtype=np.uint8)
+    random_bits = rng.integers(0, 2, size=bits.shape, dtype=np.uint8)
+    return np.where(prepared == basis, bits, random_bits)
+
+
+def channel(message, distance=0., attenuation=0.2, depolarisation=0.,
+            efficiency=1., dark_count=0., rng=None):
+    """
+    Physical channel between Alice and Bob for messages of the
+    vectorized engine: fiber loss and detector efficiency decide which
+    photons are detected, dark counts add clicks, and depolarised
+    photons as well as dark counts give random outcomes in either basis
+    (marked with the basis MIXED)
+
+    Only the detected events are drawn and returned: the surviving
+    photons are sampled as a binomial count and a random subset of
+    positions, so lost photons are never materialised
+
+    Args:
+      message (np.ndarray): (2, n) array from np_encode
+      distance (float): fiber length in km
+      attenuation (float): fiber attenuation in dB/km
+      depolarisation (float): probability of a depolarising error
+      efficiency (float): detector efficiency
+      dark_count (float): dark-count probability per detection window
+      rng (np.random.Generator | int): random generator or seed
+
+    Returns:
+      (np.ndarray, np.ndarray): sorted positions of the detected events
+        in the original message, and the (2, m) received message
+    """
+    rng = np.random.default_rng(rng)
+    n = message.shape[1]
+    transmittance = 10**(-attenuation*distance/10) * efficiency
+    n_arrived = rng.binomial(n, min(1., transmittance))
+    if n_arrived == n:
+        arrived = np.arange(n)
+    else:
+        arrived = np.sort(rng.choice(n, n_arrived, replace=False))
+    dark = rng.choice(n, rng.binomial(n, dark_count), replace=False)
+    detected = np.union1d(arrived, dark) if dark.size else arrived
+    received = message[:, detected]
+    noisy = rng.random(detected.size) < depolarisation
+    if dark.size:
+        noisy |= np.isin(detected, dark)
+    received[1, noisy] = MIXED
+    return detected, received
+
+
+def eve_intercept_resend(message, rng, fraction=1.):
+    """
+    Eve intercepts (a random <fraction> of) the qubits and measures
+    each in a uniformly random basis
+    """
+    n = message.shape[1]
+    if fraction >= 1:
+        intercepted = np.ones(n, dtype=bool)
+    else:
+        intercepted = rng.random(n) < fraction
+    bases = rng.integers(0, 2, size=n, dtype=np.uint8)
+    return intercepted, bases
+
+
+def eve_partial(message, rng, fraction=0.5):
+    """
+    Eve intercepts a random <fraction> of the qubits
+    """
+    return eve_intercept_resend(message, rng, fraction=fraction)
+
+
+def eve_biased(message, rng, bias=0.75, fraction=1.):
+    """
+    Eve intercepts (a random <fraction> of) the qubits and measures in
+    the Z-basis with probability <bias>, in the X-basis otherwise
+    """
+    intercepted, _ = eve_intercept_resend(message, rng, fraction=fraction)
+    bases = (rng.random(message.shape[1]) >= bias).astype(np.uint8)
+    return intercepted, bases
+
+
+EVE_STRATEGIES = {
+    'intercept_resend': eve_intercept_resend,
+    'partial': eve_partial,
+    'biased': eve_biased,
+}
+
+
+def intercept(message, strategy='intercept_resend', rng=None, **kwargs):
+    """
+    Intercept-resend attack on a message of the vectorized engine: Eve
+    measures the intercepted qubits and resends them prepared in her
+    own basis with her measured bit
+
+    Args:
+      message (np.ndarray): (2, n) array from np_encode
+      strategy (str | callable): key of EVE_STRATEGIES or a function
+        (message, rng, **kwargs) -> (intercepted mask, Eve's bases)
+      rng (np.random.Generator | int): random generator or seed
+      kwargs: passed on to the strategy, e.g. fraction or bias
+
+    Returns:
+      (np.ndarray, dict): the resent message and Eve's record with the
+        entries intercepted, bases, bits
+    """
+    rng = np.random.default_rng(rng)
+    if not callable(strategy):
+        strategy = EVE_STRATEGIES[strategy]
+    intercepted, bases = strategy(message, rng, **kwargs)
+    bits = np_measure(message, bases, rng=rng)
+    resent = message.copy()
+    resent[0, intercepted] = bits[intercepted]
+    resent[1, intercepted] = bases[intercepted]
+    eve = {'intercepted': intercepted, 'bases': bases, 'bits': bits}
+    return resent, eve
+
+
+def eve_report(bits_a, basis_a, bits_b, basis_b, eve):
+    """
+    Induced QBER and information leakage of an interception on the
+    sifted key; after the public basis comparison Eve knows exactly
+    those sifted bits she intercepted in Alice's basis
+
+    Returns:
+      dict: n_sifted, intercepted (fraction of sifted bits), qber,
+        leakage (fraction of sifted bits known to Eve),
+        eve_agreement (fraction of intercepted sifted bits where Eve's
+        bit equals Alice's)
+    """
+    bits_a, basis_a = np.asarray(bits_a), np.asarray(basis_a)
+    sifted = basis_a == np.asarray(basis_b)
+    n_sifted = int(np.count_nonzero(sifted))
+    errors = int(np.count_nonzero(bits_a[sifted] != np.asarray(bits_b)[sifted]))
+    intercepted = sifted & eve['intercepted']
+    n_intercepted = int(np.count_nonzero(intercepted))
+    known = int(np.count_nonzero(intercepted & (eve['bases'] == basis_a)))
+    agree = int(np.count_nonzero(eve['bits'][intercepted] == bits_a[intercepted]))
+    return {
+        'n_sifted': n_sifted,
+        'intercepted': n_intercepted / n_sifted if n_sifted else 0.,
+        'qber': errors / n_sifted if n_sifted else 0.,
+        'leakage': known / n_sifted if n_sifted else 0.,
+        'eve_agreement': agree / n_intercepted if n_intercepted else 0.,
+    }
+
+
+def sync_results(bits_a, basis_a, bits_b, basis_b,
+                 sample=0.1, confidence=0.95, rng=None, chunk_size=1 << 22):
+    """
+    Sift the raw keys of Alice and Bob (keep only bits where the bases
+    agree), disclose a random sample of the sifted bits to estimate the
+    quantum bit error rate (QBER), and discard the disclosed bits
+
+    The arrays are processed in chunks of <chunk_size> bits and the
+    sifted keys are accumulated bit-packed, so 10^8 bits never exist as
+    unpacked sifted keys at once
+
+    Args:
+      bits_a (array-like): Alice's bits
+      basis_a (array-like): Alice's bases
+      bits_b (array-like): Bob's measured bits
+      basis_b (array-like): Bob's bases
+      sample (float): fraction of sifted bits disclosed for the estimate
+      confidence (float): confidence level of the QBER bounds
+      rng (np.random.Generator | int): random generator or seed
+      chunk_size (int): number of raw bits processed at once
+
+    Returns:
+      (np.ndarray, np.ndarray, dict): packed keys of Alice and Bob
+        (see BITORDER) and statistics with the entries
+        n_sifted, n_disclosed, errors, qber, qber_bounds, n_key
+    """
+    rng = np.random.default_rng(rng)
+    n = len(basis_a)
+    key_a, key_b = BitBuffer(), BitBuffer()
+    n_sifted = n_disclosed = errors = 0
+    for start in range(0, n, chunk_size):
+        chunk = slice(start, min(start+chunk_size, n))
+        sifted = np.asarray(basis_a[chunk]) == np.asarray(basis_b[chunk])
+        a = np.asarray(bits_a[chunk], dtype=bool)[sifted]
+        b = np.asarray(bits_b[chunk], dtype=bool)[sifted]
+        disclosed = rng.random(a.size) < sample
+        errors += int(np.count_nonzero(a[disclosed] != b[disclosed]))
+        n_sifted += a.size
+        n_disclosed += int(np.count_nonzero(disclosed))
+        key_a.append(a[~disclosed])
+        key_b.append(b[~disclosed])
+    stats = {
+        'n_sifted': n_sifted,
+        'n_disclosed': n_disclosed,
+        'errors': errors,
+        'qber': errors / n_disclosed if n_disclosed else 0.,
+        'qber_bounds': qber_bounds(errors, n_disclosed, confidence),
+        'n_key': key_a.n,
+    }
+    return key_a.packed(), key_b.packed(), stats
+
+
+def qber_bounds(errors, n, confidence=0.95):
+    """
+    Wilson score interval of the QBER given <errors> in <n> disclosed bits
+    """
+    if n == 0:
+        return 0., 1.
+    z = NormalDist().inv_cdf(0.5 + confidence/2)
+    p = errors / n
+    denom = 1 + z**2/n
+    center = (p + z**2/(2*n)) / denom
+    half = z * (p*(1-p)/n + z**2/(4*n**2))**0.5 / denom
+    return max(0., center - half), min(1., center + half)
+
+
+class BitBuffer:
+    """
+    Append-only bit accumulator which stores its content bit-packed;
+    only the (< 8) bits that do not fill a byte are kept unpacked
+    """
+    def __init__(self):
+        self.chunks = []
+        self.tail = np.empty(0, dtype=bool)
+        self.n = 0
+
+    def append(self, bits):
+        bits = np.asarray(bits, dtype=bool)
+        self.n += bits.size
+        bits = np.concatenate([self.tail, bits])
+        m = bits.size - bits.size % 8
+        self.chunks.append(np.packbits(bits[:m], bitorder=BITORDER))
+        self.tail = bits[m:]
+
+    def packed(self):
+        return np.concatenate(self.chunks
+                              + [np.packbits(self.tail, bitorder=BITORDER)])
+
+
+def pack_bits(bits):
+    return np.packbits(np.asarray(bits, dtype=bool), bitorder=BITORDER)
+
+
+def unpack_bits(packed, n):
+    return np.unpackbits(packed, count=n, bitorder=BITORDER)
+
+
+def binary_entropy(p):
+    if p <= 0 or p >= 1:
+        return 0.
+    return float(-p*np.log2(p) - (1-p)*np.log2(1-p))
+
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    _POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        words = np.asarray(words, dtype=np.uint64)
+        counts = _POPCOUNT8[words.view(np.uint8)].reshape(words.shape + (8,))
+        return counts.sum(axis=-1, dtype=np.uint8)
+
+
+def as_words(packed, n):
+    """
+    View a packed key (see BITORDER) of <n> bits as uint64 words, padded
+    with (at least) one trailing zero word
+    """
+    words = np.zeros(n // 64 + 1, dtype='<u8')
+    words.view(np.uint8)[:len(packed)] = packed
+    return words
+
+
+class ParityIndex:
+    """
+    Prefix parities of a key stored in uint64 words; the parity of any
+    bit range [start, stop) is computed in O(1) with a popcount of one
+    masked word, vectorized over arrays of ranges
+    """
+    def __init__(self, words):
+        self.words = words
+        word_parity = popcount(words) & 1
+        self.word_prefix = np.zeros(len(words) + 1, dtype=np.uint8)
+        np.bitwise_xor.accumulate(word_parity, out=self.word_prefix[1:])
+
+    def prefix(self, i):
+        """Parity of bits [0, i)"""
+        i = np.asarray(i, dtype=np.int64)
+        w = i >> 6
+        mask = (np.uint64(1) << (i & 63).astype(np.uint64)) - np.uint64(1)
+        return self.word_prefix[w] ^ (popcount(self.words[w] & mask) & 1)
+
+    def parity(self, start, stop):
+        return self.prefix(start) ^ self.prefix(stop)
+
+
+def flip_bits(words, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+    np.bitwise_xor.at(words, positions >> 6,
+                      np.uint64(1) << (positions & 63).astype(np.uint64))
+
+
+def cascade(key_a, key_b, n, qber, passes=4, rng=None):
+    """
+    Cascade error reconciliation of Bob's key against Alice's
+
+    Both keys are kept as uint64 words, once per pass in that pass'
+    permutation; block parities are evaluated with XOR/popcount prefix
+    parities (see ParityIndex), and the binary searches run on all odd
+    blocks of a pass simultaneously.  A corrected bit is flipped in
+    every pass, and all passes up to the current one are re-checked
+    until no block parity disagrees anymore (the cascade).
+
+    Args:
+      key_a (np.ndarray): Alice's packed key (see BITORDER)
+      key_b (np.ndarray): Bob's packed key
+      n (int): number of bits in the keys
+      qber (float): estimated QBER, sets the first block size 0.73/qber
+      passes (int): number of passes, the block size doubles each pass
+      rng (np.random.Generator | int): random generator or seed for the
+                                       (public) permutations
+
+    Returns:
+      (np.ndarray, dict): Bob's corrected packed key and statistics with
+        the entries block_size, leaked, corrected, residual_errors,
+        seconds, throughput (Mbit/s)
+    """
+    start_time = perf_counter()
+    if n == 0:
+        # e.g. a block of which a lossy channel left no key bits
+        return key_b, {'block_size': 0, 'leaked': 0, 'corrected': 0,
+                       'residual_errors': 0, 'seconds': 0., 'throughput': 0.}
+    rng = np.random.default_rng(rng)
+    block_size = min(n, max(2, int(0.73 / qber))) if qber > 0 else n
+    bits_a = unpack_bits(key_a, n)
+    bits_b = unpack_bits(key_b, n)
+    perms = [None] + [rng.permutation(n) for _ in range(passes-1)]
+    inverse = [None]
+    for perm in perms[1:]:
+        inv = np.empty(n, dtype=np.int64)
+        inv[perm] = np.arange(n)
+        inverse.append(inv)
+    words_a = [as_words(pack_bits(bits_a if p is None else bits_a[p]), n) for p in perms]
+    words_b = [as_words(pack_bits(bits_b if p is None else bits_b[p]), n) for p in perms]
+    del bits_a, bits_b
+    leaked = corrected = 0
+    for p in range(passes):
+        # Alice discloses the parities of all blocks of this pass
+        leaked += -(-n // min(n, block_size << p)) if n else 0
+        odd_blocks = True
+        while odd_blocks:
+            odd_blocks = False
+            for q in range(p+1):
+                size = min(n, block_size << q)
+                starts = np.arange(0, n, size)
+                stops = np.minimum(starts + size, n)
+                index_a, index_b = ParityIndex(words_a[q]), ParityIndex(words_b[q])
+                odd = index_a.parity(starts, stops) != index_b.parity(starts, stops)
+                if not odd.any():
+                    continue
+                odd_blocks = True
+                # binary search for one error in every odd block at once
+                lo, hi = starts[odd], stops[odd]
+                while True:
+                    searching = hi - lo > 1
+                    if not searching.any():
+                        break
+                    mid = (lo + hi) // 2
+                    leaked += int(np.count_nonzero(searching))
+                    left = index_a.parity(lo, mid) != index_b.parity(lo, mid)
+                    hi = np.where(searching & left, mid, hi)
+                    lo = np.where(searching & ~left, mid, lo)
+                errors = lo if perms[q] is None else perms[q][lo]
+                for r in range(passes):
+                    flip_bits(words_b[r], errors if inverse[r] is None else inverse[r][errors])
+                corrected += len(errors)
+    key_b = np.ascontiguousarray(words_b[0].view(np.uint8)[:len(key_b)])
+    residual = int(popcount(words_a[0] ^ words_b[0]).sum())
+    seconds = perf_counter() - start_time
+    stats = {
+        'block_size': block_size,
+        'leaked': leaked,
+        'corrected': corrected,
+        'residual_errors': residual,
+        'seconds': seconds,
+        'throughput': n / seconds / 1e6 if seconds else float('inf'),
+    }
+    return key_b, stats
+
+
+def toeplitz_hash(key, n, out_len, seed=None, block=1 << 22):
+    """
+    Multiply a key of <n> bits by a random binary Toeplitz matrix of
+    shape (out_len, n) over GF(2)
+
+    The matrix T[i, j] = t[i - j + n - 1] is defined by <n+out_len-1>
+    seed bits, and the product is a convolution of the seed with the
+    key, evaluated with FFTs on blocks of at most <block> bits in both
+    dimensions so that the float64 sums stay exact and the FFT size
+    bounded
+
+    Returns:
+      np.ndarray: packed (see BITORDER) hash of <out_len> bits
+    """
+    rng = np.random.default_rng(seed)
+    t = rng.integers(0, 2, size=n + out_len - 1, dtype=np.uint8)
+    x = unpack_bits(key, n)
+    y = np.zeros(out_len, dtype=np.uint8)
+    for i0 in range(0, out_len, block):
+        i1 = min(i0 + block, out_len)
+        for j0 in range(0, n, block):
+            j1 = min(j0 + block, n)
+            m = j1 - j0
+            segment = t[i0 - j1 + n:i1 - j0 + n - 1]
+            size = 1 << int(np.ceil(np.log2(len(segment) + m - 1)))
+            conv = np.fft.irfft(np.fft.rfft(segment, size) * np.fft.rfft(x[j0:j1], size), size)
+            y[i0:i1] ^= np.rint(conv[m-1:m-1+i1-i0]).astype(np.int64).astype(np.uint8) & 1
+    return pack_bits(y)
+
+
+def privacy_amplification(key, n, qber=0., leaked=0, out_len=None,
+                          epsilon=1e-10, seed=None, block=1 << 22):
+    """
+    Compress a reconciled key with Toeplitz hashing (see toeplitz_hash)
+
+    Args:
+      key (np.ndarray): packed key (see BITORDER)
+      n (int): number of bits in the key
+      qber (float): estimated QBER, bounding Eve's information by h(qber)
+      leaked (int): bits disclosed during error reconciliation
+      out_len (int): final key length; by default
+                     n (1 - h(qber)) - leaked - 2 log2(1/epsilon)
+      epsilon (float): security parameter of the default key length
+      seed (np.random.Generator | int): random generator or seed of the
+                                        (public) Toeplitz matrix
+      block (int): block size of the FFT evaluation
+
+    Returns:
+      (np.ndarray, dict): packed final key and statistics with the
+        entries n_key, leaked (bits removed by the compression),
+        seconds, throughput (Mbit/s)
+    """
+    start_time = perf_counter()
+    if out_len is None:
+        out_len = int(n * (1 - binary_entropy(qber)) - leaked + 2*np.log2(epsilon))
+    out_len = max(0, min(n, out_len))
+    if n == 0:
+        return pack_bits(np.zeros(0, dtype=np.uint8)), {
+            'n_key': 0, 'leaked': 0, 'seconds': 0., 'throughput': 0.}
+    final = toeplitz_hash(key, n, out_len, seed=seed, block=block)
+    seconds = perf_counter() - start_time
+    stats = {
+        'n_key': out_len,
+        'leaked': n - out_len,
+        'seconds': seconds,
+        'throughput': n / seconds / 1e6 if seconds else float('inf'),
+    }
+    return final, stats
+
+
+def key_stream(n, chunk_size=1 << 20, sample=0.1, confidence=0.95,
+               rng=None, prefetch=0, eve=None, channel=None):
+    """
+    Streaming BB84 key generation: generate -> encode -> transmit ->
+    measure -> sift -> estimate, one chunk of raw bits at a time
+
+    Only one chunk (plus at most <prefetch> finished blocks) is held in
+    memory at any time, independently of <n>.  The generator is lazy,
+    i.e. a chunk is only produced when the consumer asks for it; with
+    prefetch > 0 a background thread works ahead but blocks as soon as
+    <prefetch> blocks wait to be consumed.
+
+    Args:
+      n (int): total number of raw bits
+      chunk_size (int): raw bits per chunk
+      sample (float): fraction of sifted bits disclosed for the QBER
+      confidence (float): confidence level of the QBER bounds
+      rng (np.random.Generator | int): random generator or seed
+      prefetch (int): number of blocks computed ahead of the consumer
+      eve (callable): optional adversary (message, rng) -> (message, record),
+                      e.g. functools.partial(intercept, strategy='partial'),
+                      whose eve_report is added to the block statistics
+      channel (callable): optional channel (message, rng) -> (detected, message),
+                          e.g. functools.partial(channel, distance=50)
+
+    Yields:
+      (np.ndarray, np.ndarray, dict): packed sifted key blocks of Alice
+        and Bob, and the running statistics (see sync_results) with the
+        statistics of the current block under 'block'
+    """
+    blocks = key_blocks(n, chunk_size, sample, rng, eve=eve, channel=channel)
+    if prefetch:
+        blocks = prefetched(blocks, prefetch)
+    running = {'n_raw': 0, 'n_detected': 0, 'n_sifted': 0, 'n_disclosed': 0,
+               'errors': 0, 'n_key': 0}
+    for n_raw, key_a, key_b, stats in blocks:
+        running['n_raw'] += n_raw
+        for k in ('n_detected', 'n_sifted', 'n_disclosed', 'errors', 'n_key'):
+            running[k] += stats[k]
+        errors, n_disclosed = running['errors'], running['n_disclosed']
+        running['qber'] = errors / n_disclosed if n_disclosed else 0.
+        running['qber_bounds'] = qber_bounds(errors, n_disclosed, confidence)
+        running['block'] = stats
+        yield key_a, key_b, dict(running)
+
+
+def key_blocks(n, chunk_size=1 << 20, sample=0.1, rng=None, eve=None,
+               channel=None):
+    """
+    Generator of (n_raw, key_a, key_b, stats) per chunk of raw bits
+    using the vectorized engine (see key_stream)
+    """
+    rng = np.random.default_rng(rng)
+    for start in range(0, n, chunk_size):
+        m = min(chunk_size, n - start)
+        bits_a, basis_a, basis_b = rng.integers(0, 2, size=(3, m), dtype=np.uint8)
+        message = bb84_encode(bits_a, basis_a, backend='numpy')
+        if eve is not None:
+            message, record = eve(message, rng=rng)
+        if channel is not None:
+            detected, message = channel(message, rng=rng)
+            bits_a, basis_a, basis_b = bits_a[detected], basis_a[detected], basis_b[detected]
+            if eve is not None:
+                record = {k: v[detected] for k, v in record.items()}
+        bits_b = measure_key(message, basis_b, backend='numpy', rng=rng)
+        key_a, key_b, stats = sync_results(bits_a, basis_a, bits_b, basis_b,
+                                           sample=sample, rng=rng, chunk_size=m)
+        stats['n_detected'] = len(basis_b)
+        if eve is not None:
+            stats['eve'] = eve_report(bits_a, basis_a, bits_b, basis_b, record)
+        yield m, key_a, key_b, stats
+
+
+def prefetched(iterable, maxsize=1):
+    """
+    Iterate over <iterable> in a background thread, buffering at most
+    <maxsize> items; the producer blocks while the buffer is full, so a
+    slow consumer throttles production instead of accumulating items
+    """
+    queue = Queue(maxsize=maxsize)
+    stop = Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        queue.put((item, None), timeout=0.1)
+                        break
+                    except Full:
+                        continue
+                if stop.is_set():
+                    return
+            queue.put((done, None))
+        except Exception as e:
+            queue.put((done, e))
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        # release a producer waiting on the full queue
+        try:
+            queue.get_nowait()
+        except Empty:
+            pass
+        producer.join()
 
 
 def print_qbit(code, index, bits, bases, show=True):
     print(f'bit   = {bits[index]:2d}')
     print(f'basis = {bases[index]:2d}\n')
     if show:
+        from matplotlib import pyplot as plt
         code[index].draw("mpl")
         plt.show()
 
@@ -73,6 +733,43 @@ if __name__ == "__main__":
     
     # Bob also choose random bases
     bob_bases = randint(2, size=n)
-    bob_measr = measure_key(key_msg, bob_bases)
+    bob_measr = measure_key(key_msg, bob_bases, batch_size=n)
     print_qbit(key_msg, 0, bob_measr, bob_bases)
     print_qbit(key_msg, 1, bob_measr, bob_bases)
+
+    # cross-check against the vectorized engine: where the bases agree,
+    # both backends must reproduce Alice's bits
+    np_msg = bb84_encode(alice_bbits, alice_bases, backend='numpy')
+    np_measr = measure_key(np_msg, bob_bases, backend='numpy', rng=42)
+    agree = alice_bases == bob_bases
+    print('qiskit:', np.array(bob_measr)[agree])
+    print('numpy: ', np_measr[agree])
+
+    # sifted keys and running QBER estimate streamed in blocks
+    for key_a, key_b, stats in key_stream(10**7, rng=42, prefetch=2):
+        print(f"{stats['n_raw']:10d} raw bits -> {stats['n_key']:10d} key bits, "
+              f"QBER {stats['qber']:.4f} {stats['qber_bounds']}")
+
+    # intercept-resend sweep over the interception fraction
+    bits_a, basis_a, basis_b = np.random.default_rng(42).integers(0, 2, size=(3, 10**6))
+    message = bb84_encode(bits_a, basis_a, backend='numpy')
+    for fraction in np.linspace(0, 1, 5):
+        resent, record = intercept(message, 'partial', rng=42, fraction=fraction)
+        bits_b = measure_key(resent, basis_b, backend='numpy', rng=42)
+        print(f'Eve {fraction:.2f}:', eve_report(bits_a, basis_a, bits_b, basis_b, record))
+
+    # lossy, noisy fiber: only the detected events are simulated
+    for distance in (0, 50, 100, 150):
+        detected, received = channel(message, distance=distance, depolarisation=0.02,
+                                     efficiency=0.5, dark_count=1e-6, rng=42)
+        bits_b = measure_key(received, basis_b[detected], backend='numpy', rng=42)
+        _, _, channel_stats = sync_results(bits_a[detected], basis_a[detected],
+                                           bits_b, basis_b[detected], rng=42)
+        print(f'{distance:3d} km: {len(detected)} detected, QBER {channel_stats["qber"]:.4f}')
+
+    # error correction and privacy amplification of the last block
+    n_key, qber = stats['block']['n_key'], stats['qber']
+    key_b, ec_stats = cascade(key_a, key_b, n_key, qber, rng=42)
+    final_key, pa_stats = privacy_amplification(key_a, n_key, qber, ec_stats['leaked'], seed=42)
+    print(ec_stats)
+    print(pa_stats)
@@ -0,0 +1,214 @@
+import sys
+import json
+import argparse
+import importlib.util
+import platform
+import tempfile
+from time import perf_counter
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+
+def timeit(fn, repeat=3, min_time=0.05):
+    """
+    Wall time per call of fn; each of the <repeat> measurements loops
+    over enough calls to take at least <min_time> seconds, so that fast
+    benchmarks are not dominated by timer noise
+
+    Returns:
+      dict: best and median time per call in seconds, the number of
+            measurements and of calls per measurement
+    """
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((perf_counter() - start) / number)
+    return {'best': min(times), 'median': float(np.median(times)),
+            'repeat': repeat, 'number': number}
+
+
+def make_assets(out_dir):
+    """
+    Generate all SVG assets into <out_dir> (svg_components.py plus
+    the head texts), so no downloaded assets are needed
+    """
+    import svgutils.compose as sc
+    import svg_components
+    out_dir = Path(out_dir)
+    svg_components.svg_wave_variants(500, -1, 1, out_dir=out_dir)
+    svg_components.svg_detector_variants(lw=12, out_dir=out_dir)
+    for name, text in [('alice_text', 'Alice'), ('bob_text', 'Bob')]:
+        sc.Figure("300", "100", sc.Text(text, 0, 80, size=80, color='#ffffff')
+                  ).save(str(out_dir / f"{name}.svg"))
+    return out_dir
+
+
+def scene_states():
+    """
+    A representative frame state of each anim.py scene
+    """
+    import anim
+    return {
+        'transmission': anim.transmission_states(1, 60, 0, 1, 1, 1)[1][30],
+        'transition': anim.transition_states(1, 60, 0, 0, 'alice')[1][30],
+        'detection': anim.detection_states(1, 60, 0, 1, 'bob')[1][30],
+    }
+
+
+def bench_render(asset_dir, resolutions, repeat=3):
+    """
+    Time the render stages of each scene state at each resolution:
+    layout construction, recoloring, SVG serialization, cairosvg
+    rasterization of the full frame, compositing (with a cold and a
+    warm raster cache) and the PNG write of the rendered frame
+    """
+    import svgutils.compose as sc
+    from PIL import Image
+    from layout import BB84Setup, icons, raster_cache
+    BB84Setup.icon_base = Path(asset_dir)
+    icons.invalidate()
+    results = {}
+    for resolution in resolutions:
+        w, h = resolution
+        for scene, state in scene_states().items():
+            name = f"render/{scene}/{w}x{h}"
+
+            def construct():
+                layout = BB84Setup(resolution=resolution,
+                                   head_icons=[icons.get(asset_dir/"alice_text.svg"),
+                                               icons.get(asset_dir/"bob_text.svg")])
+                for party, kwargs in state.items():
+                    layout.set_index(party, **kwargs)
+                return layout
+
+            def cold():
+                raster_cache.clear()
+                layout.composite(out)
+
+            layout = construct()
+            icon = layout.detector_icons['alice'][0]
+            panels = [layout.setup_alice(), layout.setup_bob(), layout.setup_signal()]
+            figure = sc.Figure(str(w), str(h), *panels)
+            out = np.zeros((h, w, 4), dtype=np.uint8)
+            results[f"{name}/construct"] = timeit(construct, repeat)
+            results[f"{name}/set_svg_color"] = timeit(
+                lambda: layout.set_svg_color(icon, color={'stroke': layout.alice_color}),
+                repeat)
+            results[f"{name}/set_svg_color_text"] = timeit(
+                lambda: layout.set_svg_color(sc.Text("1", size=layout.font_size),
+                                             color={'fill': layout.alice_color},
+                                             default_color='black'),
+                repeat)
+            results[f"{name}/tostr"] = timeit(figure.tostr, repeat)
+            results[f"{name}/rasterize"] = timeit(
+                lambda: layout.pixelate_svg(figure), repeat)
+            results[f"{name}/composite_cold"] = timeit(cold, repeat)
+            results[f"{name}/composite_warm"] = timeit(
+                lambda: layout.composite(out), repeat)
+            # the PNG encode and write alone, of a frame rendered once
+            frame = layout.render()
+            results[f"{name}/write"] = timeit(
+                lambda: Image.fromarray(frame).save(Path(asset_dir) / "frame.png"), repeat)
+            print(f"{name} done", file=sys.stderr)
+    return results
+
+
+def bench_protocol(sizes, repeat=3, qiskit_max=100, seed=0):
+    """
+    Time encoding, measuring and sifting of <sizes> bits with the
+    vectorized engine (and with qiskit up to <qiskit_max> bits, if it
+    is installed)
+    """
+    import bb84
+    if importlib.util.find_spec('qiskit') is None:
+        qiskit_max = 0
+    rng = np.random.default_rng(seed)
+    results = {}
+    for n in sizes:
+        bits, basis_a, basis_b = rng.integers(0, 2, size=(3, n), dtype=np.uint8)
+        message = bb84.np_encode(bits, basis_a)
+        bits_b = bb84.np_measure(message, basis_b, rng=rng)
+        results[f"protocol/encode/numpy/{n}"] = timeit(
+            lambda: bb84.bb84_encode(bits, basis_a, backend='numpy'), repeat)
+        results[f"protocol/measure/numpy/{n}"] = timeit(
+            lambda: bb84.measure_key(message, basis_b, backend='numpy', rng=rng), repeat)
+        results[f"protocol/sift/{n}"] = timeit(
+            lambda: bb84.sync_results(bits, basis_a, bits_b, basis_b, rng=rng), repeat)
+        if n <= qiskit_max:
+            circuits = bb84.bb84_encode(bits, basis_a)
+            results[f"protocol/encode/qiskit/{n}"] = timeit(
+                lambda: bb84.bb84_encode(bits, basis_a), repeat)
+            results[f"protocol/measure/qiskit/{n}"] = timeit(
+                lambda: bb84.measure_key(circuits, basis_b, batch_size=n), repeat)
+        print(f"protocol/{n} done", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    Print the best times against a baseline and flag every benchmark
+    which got slower by more than a factor of <threshold>
+
+    Returns:
+      list(str): names of the regressed benchmarks
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name]['best'] / baseline[name]['best']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = 'REGRESSION'
+        print(f"{name:48s} {1e3*baseline[name]['best']:10.3f} ms "
+              f"{1e3*results[name]['best']:10.3f} ms {ratio:6.2f}x {flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the render pipeline and the BB84 simulation")
+    parser.add_argument('--only', choices=['render', 'protocol'],
+                        help="run only one half of the suite")
+    parser.add_argument('--resolutions', default="1280x720,1920x1080,4096x2160")
+    parser.add_argument('--max-bits', type=int, default=10**7)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', default="bench.json")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="flag regressions against a stored result file")
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = {}
+    if args.only != 'protocol':
+        resolutions = [tuple(int(x) for x in r.split('x'))
+                       for r in args.resolutions.split(',')]
+        with tempfile.TemporaryDirectory() as tmp:
+            asset_dir = make_assets(tmp)
+            results.update(bench_render(asset_dir, resolutions, args.repeat))
+    if args.only != 'render':
+        sizes = [10**k for k in range(2, 8) if 10**k <= args.max_bits]
+        results.update(bench_protocol(sizes, args.repeat))
+    meta = {'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor()}
+    Path(args.output).write_text(json.dumps({'meta': meta, 'results': results}, indent=1))
+    print(args.output)
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
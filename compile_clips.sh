@@ -1,6 +1,9 @@
 #!/bin/sh
 
 DIR=${1:-tmp/transmission1}
+# the black base canvas defaults to the size of the first frame
+SIZE=${2:-$(ffprobe -v error -select_streams v:0 -show_entries stream=width,height -of csv=s=x:p=0 ${DIR}/frame_00000.png)}
+FPS=${3:-60}
 BASENAME=$(basename $DIR)
 
-ffmpeg -framerate 60 -i ${DIR}/frame_%05d.png -c:v libx265 -crf 1 -filter_complex "color=c=black:size=1920x1440 [base]; [base][0:v]overlay=shortest=1" ${BASENAME}.mp4
+ffmpeg -framerate ${FPS} -i ${DIR}/frame_%05d.png -c:v libx265 -crf 1 -filter_complex "color=c=black:size=${SIZE} [base]; [base][0:v]overlay=shortest=1" ${BASENAME}.mp4
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import resource
+import threading
+from time import perf_counter
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+PAGE_SIZE = resource.getpagesize()
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes (over its lifetime)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def rss():
+    """
+    Current resident set size of this process in bytes, None where
+    /proc is not available (e.g. on macOS)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+
+class Instrument:
+    """
+    Opt-in recorder of timed stages as Chrome trace events (complete
+    events, 'ph': 'X'), which can be loaded in chrome://tracing or
+    Perfetto; timestamps come from the monotonic clock, so events of
+    several render processes line up.  While disabled, span() costs a
+    single attribute check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name, cat='render'):
+        """
+        Context manager timing a stage; it yields a dict of arguments
+        (e.g. 'bytes' rasterized) the stage may fill in
+        """
+        if not self.enabled:
+            return nullcontext({})
+        return self.record(name, cat)
+
+    @contextmanager
+    def record(self, name, cat):
+        args = {}
+        rss_start = rss()
+        start = perf_counter()
+        try:
+            yield args
+        finally:
+            end = perf_counter()
+            rss_end = rss()
+            if rss_end is not None:
+                args['rss'] = rss_end
+                args['rss_delta'] = rss_end - rss_start
+            args['peak_rss'] = peak_rss()
+            event = {'name': name, 'cat': cat, 'ph': 'X',
+                     'ts': 1e6 * start,
+                     'dur': 1e6 * (end - start),
+                     'pid': os.getpid(), 'tid': threading.get_ident(),
+                     'args': args}
+            with self.lock:
+                self.events.append(event)
+
+    def drain(self):
+        """
+        Take the events recorded so far (e.g. to send them from a render
+        process to the parent)
+        """
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+
+instrument = Instrument()
+
+
+def save_trace(filename, events):
+    """
+    Write events as a Chrome trace JSON file
+    """
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summary(events):
+    """
+    Table of the recorded stages: calls, total and mean wall time, MiB
+    rasterized, the largest RSS growth during a single call of the stage
+    (where the current RSS is available, see rss) and the lifetime peak
+    RSS of the largest process, sorted by total time
+    """
+    stages = defaultdict(lambda: {'calls': 0, 'dur': 0., 'max': 0., 'bytes': 0,
+                                  'growth': 0, 'peak': 0})
+    for event in events:
+        stage = stages[event['name']]
+        stage['calls'] += 1
+        stage['dur'] += event['dur']
+        stage['max'] = max(stage['max'], event['dur'])
+        stage['bytes'] += event['args'].get('bytes', 0)
+        stage['growth'] = max(stage['growth'], event['args'].get('rss_delta', 0))
+        stage['peak'] = max(stage['peak'], event['args'].get('peak_rss', 0))
+    lines = [f"{'stage':24s} {'calls':>7s} {'total s':>9s} {'mean ms':>9s} "
+             f"{'max ms':>9s} {'MiB rast.':>10s} {'RSS growth MiB':>15s} "
+             f"{'process peak MiB':>17s}"]
+    for name, s in sorted(stages.items(), key=lambda item: -item[1]['dur']):
+        lines.append(f"{name:24s} {s['calls']:7d} {s['dur']/1e6:9.2f} "
+                     f"{s['dur']/1e3/s['calls']:9.2f} {s['max']/1e3:9.2f} "
+                     f"{s['bytes']/2**20:10.1f} {s['growth']/2**20:15.1f} "
+                     f"{s['peak']/2**20:17.1f}")
+    return "\n".join(lines)
@@ -1,11 +1,17 @@
+import re
 from pathlib import Path
 from copy import deepcopy
+from collections import OrderedDict, Counter
+from collections.abc import Sequence
 import numpy as np
 import svgutils.compose as sc
-import cairosvg
+import svgutils.transform as st
+import sys
+from cairosvg.surface import PNGSurface
+from cairosvg.parser import Tree
 import cairocffi
+from instrument import instrument
 from PIL import Image
-from io import BytesIO
 from matplotlib import pyplot as plt
 
 def brighten(hex_color, factor):
@@ -15,6 +21,438 @@ def brighten(hex_color, factor):
     return '#{:02X}{:02X}{:02X}'.format(*brighter)
 
 
+# channel order of cairo's native-endian ARGB32 pixels as RGBA
+CAIRO_RGBA = [2, 1, 0, 3] if sys.byteorder == 'little' else [1, 2, 3, 0]
+# alpha channel of cairo's ARGB32 pixels
+ALPHA = CAIRO_RGBA[3]
+
+
+class ArraySurface(PNGSurface):
+    """
+    cairosvg surface which renders into a NumPy-owned ARGB32 buffer
+    (premultiplied, see CAIRO_RGBA) instead of encoding a PNG
+    """
+    def _create_surface(self, width, height):
+        width, height = int(round(width)), int(round(height))
+        stride = cairocffi.ImageSurface.format_stride_for_width(
+            cairocffi.FORMAT_ARGB32, width)
+        buffer = np.zeros((height, stride // 4, 4), dtype=np.uint8)
+        surface = cairocffi.ImageSurface.create_for_data(
+            buffer, cairocffi.FORMAT_ARGB32, width, height, stride)
+        self.array = buffer[:, :width]
+        return surface, width, height
+
+
+def unpremultiply(buffer, out=None):
+    """
+    Convert a premultiplied uint8 array (alpha last) to straight alpha
+    """
+    if out is None:
+        out = np.empty_like(buffer)
+    alpha = buffer[..., 3:4].astype(np.uint16)
+    rgb = buffer[..., :3].astype(np.uint16) * 255 + alpha // 2
+    rgb //= np.maximum(alpha, 1)
+    np.minimum(rgb, 255, out=rgb)
+    out[..., :3] = rgb
+    out[..., 3] = buffer[..., 3]
+    return out
+
+
+def to_rgba(buffer, out=None):
+    """
+    Convert a premultiplied cairo ARGB32 array to straight-alpha RGBA
+    """
+    return unpremultiply(buffer[..., CAIRO_RGBA], out=out)
+
+
+def composite(dst, src, alpha=1., x=0, y=0):
+    """
+    Porter-Duff 'over' of a premultiplied uint8 layer <src>, faded by
+    <alpha>, onto the premultiplied buffer <dst> (in place) with the
+    top-left corner of <src> at (x, y); both are in the same channel
+    order (cairo ARGB32, see CAIRO_RGBA)
+    """
+    height, width = dst.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + src.shape[1], width), min(y + src.shape[0], height)
+    if x1 <= x0 or y1 <= y0:
+        return dst
+    dst = dst[y0:y1, x0:x1]
+    src = src[y0-y:y1-y, x0-x:x1-x].astype(np.uint16)
+    if alpha < 1:
+        src *= np.uint16(round(alpha * 255))
+        src += 127
+        src //= 255
+    blend = dst * (255 - src[..., ALPHA, None])
+    blend += 127
+    blend //= 255
+    blend += src
+    dst[...] = blend
+    return dst
+
+
+def transform_matrix(transform):
+    """
+    3x3 affine matrix of an SVG transform attribute (as produced by
+    svgutils' moveto, rotate, skew_x, and skew_y)
+    """
+    matrix = np.eye(3)
+    for op, args in re.findall(r'(\w+)\s*\(([^)]*)\)', transform or ''):
+        args = [float(a) for a in re.split(r'[\s,]+', args.strip()) if a]
+        m = np.eye(3)
+        if op == 'translate':
+            m[0, 2], m[1, 2] = args[0], args[1] if len(args) > 1 else 0
+        elif op == 'scale':
+            m[0, 0], m[1, 1] = args[0], args[1] if len(args) > 1 else args[0]
+        elif op == 'rotate':
+            a = np.radians(args[0])
+            cx, cy = args[1:3] if len(args) > 2 else (0, 0)
+            c, s = np.cos(a), np.sin(a)
+            m[:2, :2] = [[c, -s], [s, c]]
+            m[:2, 2] = [cx - c*cx + s*cy, cy - s*cx - c*cy]
+        elif op == 'skewX':
+            m[0, 1] = np.tan(np.radians(args[0]))
+        elif op == 'skewY':
+            m[1, 0] = np.tan(np.radians(args[0]))
+        elif op == 'matrix':
+            m[:2, :] = np.reshape(args, (3, 2)).T
+        matrix = matrix @ m
+    return matrix
+
+
+def element_box(element, pad=16):
+    """
+    Pixel bounding box (x0, y0, x1, y1) of a placed svgutils element:
+    the icon's (width x height) frame, or an estimate of a text's
+    extent, mapped through the element's transform, plus <pad> pixels
+    """
+    root = element.root
+    width, height = getattr(element, 'width', None), getattr(element, 'height', None)
+    if width is None or height is None:
+        # text: advance of ~0.6 em per glyph, ascent 1 em, descent 0.3 em
+        size = float(root.get('font-size', 8))
+        x, y = float(root.get('x', 0)), float(root.get('y', 0))
+        n = len(root.text or '')
+        corners = [(x, y - size), (x + 0.6*size*n, y - size),
+                   (x, y + 0.3*size), (x + 0.6*size*n, y + 0.3*size)]
+    else:
+        corners = [(0, 0), (width, 0), (0, height), (width, height)]
+    points = transform_matrix(root.get('transform')) @ np.array(
+        [[cx, cy, 1] for cx, cy in corners]).T
+    x0, y0 = np.floor(points[:2].min(axis=1)) - pad
+    x1, y1 = np.ceil(points[:2].max(axis=1)) + pad
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def color_index(svgobj, default_color):
+    """
+    Elements of an SVG which carry <default_color>, as a dict mapping
+    'fill'/'stroke' to a list of (position in root.iter(), attribute)
+    pairs, where attribute is the key itself or 'style'
+    """
+    default_color = default_color.lower()
+    index = {'fill': [], 'stroke': []}
+    for i, e in enumerate(svgobj.root.iter()):
+        style = e.get('style') or ''
+        for key in index:
+            if e.get(key) == default_color:
+                index[key].append((i, key))
+            if f'{key}: {default_color}' in style:
+                index[key].append((i, 'style'))
+    return index
+
+
+def recolor(svgobj, index, color, default_color):
+    """
+    Recolor the indexed elements of <svgobj> in place (see color_index)
+    """
+    default_color = default_color.lower()
+    elements = None
+    for key, value in color.items():
+        value = value.lower()
+        for i, attribute in index.get(key, ()):
+            if elements is None:
+                elements = list(svgobj.root.iter())
+            e = elements[i]
+            if attribute == 'style':
+                e.set('style', e.get('style').replace(f'{key}: {default_color}',
+                                                      f'{key}: {value}'))
+            else:
+                e.set(key, value)
+    return svgobj
+
+
+def svg_from_string(text):
+    """
+    An svgutils.compose.SVG parsed from SVG text instead of a file
+    """
+    svg = st.fromstring(text)
+    icon = sc.SVG()
+    sc.Element.__init__(icon, svg.getroot().root)
+    icon._width = None if svg.width.endswith('%') else sc.Unit(svg.width).to('px')
+    icon._height = None if svg.height.endswith('%') else sc.Unit(svg.height).to('px')
+    return icon
+
+
+class IconRegistry:
+    """
+    Process-wide registry of parsed SVG assets.  Each file is parsed
+    once (lazily, on first request) and kept as a template; layouts
+    receive their own copies of the templates, so moving, rotating or
+    recoloring an icon never touches the template.  Recolored variants
+    are memoized per (asset, color).  At most <maxsize> templates and
+    <maxsize> variants are kept (least recently used are dropped first).
+    Assets can also be added as SVG text (see add), e.g. straight from
+    svg_components.py without writing them to disk.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.sources = {}
+        self.templates = OrderedDict()
+        self.indices = {}
+        self.variants = OrderedDict()
+        # bumped by add/invalidate, see key
+        self.epoch = 0
+        self.generations = Counter()
+
+    def key(self, path):
+        """
+        Cache key of an asset (or of a nested list of assets): its path
+        and how often it was (re-)registered or invalidated, so that keys
+        change with the asset's contents
+        """
+        if isinstance(path, (list, tuple)):
+            return tuple(self.key(p) for p in path)
+        return str(path), self.epoch, self.generations[str(path)]
+
+    def template(self, path):
+        """
+        The shared, parsed template of an asset (must not be modified)
+        """
+        key = str(path)
+        if key in self.templates:
+            self.templates.move_to_end(key)
+        else:
+            if key in self.sources:
+                self.templates[key] = svg_from_string(self.sources[key])
+            else:
+                self.templates[key] = sc.SVG(path)
+            if len(self.templates) > self.maxsize:
+                self.templates.popitem(last=False)
+        return self.templates[key]
+
+    def get(self, path):
+        """
+        A private copy of an asset; its <source> attribute identifies the
+        asset (e.g. for cache keys)
+        """
+        icon = deepcopy(self.template(path))
+        icon.source = str(path)
+        return icon
+
+    def variant(self, path, color, default_color):
+        """
+        A private copy of an asset with <default_color> replaced by
+        <color> (dict mapping 'fill'/'stroke' to a color)
+        """
+        key = (str(path), freeze(color), default_color.lower())
+        if key in self.variants:
+            self.variants.move_to_end(key)
+        else:
+            template = self.template(path)
+            if key[::2] not in self.indices:
+                self.indices[key[::2]] = color_index(template, default_color)
+            index = self.indices[key[::2]]
+            self.variants[key] = recolor(deepcopy(template), index, color, default_color)
+            if len(self.variants) > self.maxsize:
+                self.variants.popitem(last=False)
+        icon = deepcopy(self.variants[key])
+        icon.source = str(path)
+        return icon
+
+    def add(self, path, text):
+        """
+        Register SVG text as the asset <path>; it takes precedence over
+        the file (if any) until invalidated
+        """
+        self.invalidate(path)
+        self.sources[str(path)] = text
+
+    def invalidate(self, path=None):
+        """
+        Drop the template of <path>, or all templates if path is None,
+        e.g. after svg_components.py regenerated the assets
+        """
+        if path is None:
+            self.epoch += 1
+            self.sources.clear()
+            self.templates.clear()
+            self.indices.clear()
+            self.variants.clear()
+        else:
+            self.generations[str(path)] += 1
+            self.sources.pop(str(path), None)
+            self.templates.pop(str(path), None)
+            for key in [k for k in self.indices if k[0] == str(path)]:
+                del self.indices[key]
+            for key in [k for k in self.variants if k[0] == str(path)]:
+                del self.variants[key]
+
+
+icons = IconRegistry()
+
+
+class IconList(Sequence):
+    """
+    A list of registry icons which copies an icon from its template
+    only on first access; nested lists of paths become nested IconLists
+    """
+    def __init__(self, paths, registry=None):
+        self.paths = paths
+        self.registry = icons if registry is None else registry
+        self.items = [None] * len(paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if self.items[i] is None:
+            path = self.paths[i]
+            if isinstance(path, (list, tuple)):
+                self.items[i] = IconList(path, self.registry)
+            else:
+                self.items[i] = self.registry.get(path)
+        return self.items[i]
+
+
+def freeze(obj):
+    """
+    Hashable, canonical version of (nested) index values
+    """
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return tuple(freeze(v) for v in obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Path):
+        return str(obj)
+    return obj
+
+
+class RasterCache:
+    """
+    LRU cache of rasterized layers bounded by <max_bytes> of pixel data.
+    Keys are tuples starting with the layer name; hits and misses are
+    counted per layer name.
+    """
+    def __init__(self, max_bytes=2 << 30):
+        self.max_bytes = max_bytes
+        self.layers = OrderedDict()
+        self.nbytes = 0
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, key):
+        if key in self.layers:
+            self.layers.move_to_end(key)
+            self.hits[key[0]] += 1
+            return self.layers[key][0]
+        self.misses[key[0]] += 1
+        return None
+
+    def put(self, key, images):
+        size = sum(img.nbytes for img, _, _ in images)
+        if size > self.max_bytes:
+            return images
+        if key in self.layers:
+            self.nbytes -= self.layers.pop(key)[1]
+        self.layers[key] = (images, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self.layers.popitem(last=False)
+            self.nbytes -= evicted
+        return images
+
+    def clear(self):
+        self.layers.clear()
+        self.nbytes = 0
+        self.hits.clear()
+        self.misses.clear()
+
+    def stats(self):
+        return {'layers': len(self.layers), 'nbytes': self.nbytes,
+                'hits': dict(self.hits), 'misses': dict(self.misses)}
+
+
+raster_cache = RasterCache()
+
+
+class TallyCanvas:
+    """
+    Incrementally drawn tally layer: glyph tiles of tally cells are
+    blitted onto a premultiplied ARGB32 canvas.  The cells are grouped
+    in rows (e.g. Alice's bits); if every row of a frame extends the
+    row drawn for the previous frame, only the appended cells are
+    blitted, otherwise the canvas is redrawn.
+    """
+    def __init__(self, resolution):
+        self.canvas = np.zeros((resolution[1], resolution[0], 4), dtype=np.uint8)
+        self.rows = {}
+        self.box = None
+
+    def clear(self):
+        if self.box is not None:
+            x0, y0, x1, y1 = self.box
+            self.canvas[y0:y1, x0:x1] = 0
+        self.rows = {}
+        self.box = None
+
+    def blit(self, tiles):
+        h, w = self.canvas.shape[:2]
+        for img, x, y in tiles:
+            composite(self.canvas, img, x=x, y=y)
+            box = (max(x, 0), max(y, 0),
+                   min(x + img.shape[1], w), min(y + img.shape[0], h))
+            if box[0] >= box[2] or box[1] >= box[3]:
+                continue
+            if self.box is None:
+                self.box = box
+            else:
+                self.box = (min(self.box[0], box[0]), min(self.box[1], box[1]),
+                            max(self.box[2], box[2]), max(self.box[3], box[3]))
+
+    def update(self, rows, tiles):
+        """
+        Draw the cells of a frame
+
+        Args:
+          rows (dict): row name -> list of cell keys, each identifying a
+                       glyph at its position
+          tiles (callable): tiles(row name, cell key) -> glyph tiles
+
+        Returns:
+          list((np.ndarray, int, int)): the drawn part of the canvas as a
+            single tile (empty if nothing was drawn)
+        """
+        extends = set(self.rows) <= set(rows) and all(
+            cells[:len(self.rows.get(name, []))] == self.rows.get(name, [])
+            for name, cells in rows.items())
+        if not extends:
+            self.clear()
+        for name, cells in rows.items():
+            drawn = self.rows.setdefault(name, [])
+            for cell in cells[len(drawn):]:
+                self.blit(tiles(name, cell))
+                drawn.append(cell)
+        if self.box is None:
+            return []
+        x0, y0, x1, y1 = self.box
+        return [(self.canvas[y0:y1, x0:x1], x0, y0)]
+
+
 class BB84Setup:
     """
     A layout of the BB84 setup of two parties, Alice and Bob, and an
@@ -33,6 +471,31 @@ class BB84Setup:
     public_color = "#F6F9FE"
     font_family = "Source Sans Pro"
     font_size = 64
+    # layers in stacking order, and the index entries of each party
+    # which affect the layer's rasterization
+    layers = ('alice', 'bob', 'eve', 'tally', 'signal')
+    layer_fields = {
+        'alice': ('name', 'head', 'head_scale', 'head_offset',
+                  'detector', 'detector_scale', 'detector_color',
+                  'detector_rotation', 'detector_offset'),
+        'tally': ('name', 'head', 'head_offset',
+                  'tally', 'tally_scale', 'tally_x_adjust', 'tally_color',
+                  'tally_offset', 'tally_bases', 'tally_bases_scale',
+                  'tally_bases_x_adjust', 'tally_bases_color', 'tally_bases_offset'),
+        'signal': ('name', 'head', 'head_offset', 'is_sender',
+                   'signal', 'signal_scale', 'signal_offset', 'signal_y_adjust',
+                   'signal_distance', 'signal_polarisation'),
+    }
+    layer_fields['bob'] = layer_fields['alice']
+    raster_cache = raster_cache
+    # number of detector icons (see svg_components.detector_svgs)
+    detector_variants = 32
+    # place the signal as a cached sprite instead of rasterizing per frame
+    sprite_signal = True
+    # draw the tally from a glyph atlas onto an incrementally updated canvas
+    atlas_tally = True
+    tally_canvases = OrderedDict()
+    max_tally_canvases = 4
 
     def __init__(self,
                  resolution=(4096, 2160),
@@ -42,7 +505,8 @@ class BB84Setup:
                  head_icons=None,
                  detector_icons=None,
                  activation_icons=None,
-                 signal_icons=None):
+                 signal_icons=None,
+                 draft=1):
         """
         Args:
           resolution (int, int)
@@ -53,8 +517,12 @@ class BB84Setup:
           detector_icons (list(svgutils.compose.SVG))
           activation_icons (list(svgutils.compose.SVG))
           signal_icons (list(svgutils.compose.SVG))
+          draft (float): render at this fraction of <resolution>; icon
+                         scales and centers are scaled along, so the
+                         composition matches the full-size render
         """
-        self.resolution = resolution
+        self.draft = draft
+        self.resolution = tuple(int(round(v * draft)) for v in resolution)
         if positions is None:
             positions = [[0, 0], [1, 1]]
         self.positions = positions
@@ -62,17 +530,22 @@ class BB84Setup:
         self.bob_index = self.default_index(bob_index, 'bob')
         self.head_icons = head_icons
         if detector_icons is None:
-            self.detector_icons = {
+            detector_icons = {
                 'alice': self.load_detector_svgs(self.icon_base),
                 'bob': self.load_detector_svgs(self.icon_base)}
+        self.detector_icons = detector_icons
         if activation_icons is None:
-            self.activation_icons = {
+            activation_icons = {
                 'alice': self.load_activation_svgs(self.icon_base),
                 'bob': self.load_activation_svgs(self.icon_base)}
+        self.activation_icons = activation_icons
         if signal_icons is None:
-            self.signal_icons = {
+            signal_icons = {
                 'alice': self.load_signal_svgs(self.icon_base),
                 'bob': self.load_signal_svgs(self.icon_base)}
+        self.signal_icons = signal_icons
+        # pixel bounding boxes of the components of each layer
+        self.boxes = {}
 
     @property
     def has_head(self):
@@ -119,6 +592,12 @@ class BB84Setup:
                          if party.lower() == 'alice' else u_vec(1.7*det_x, 4.0*det_y))
         return index
 
+    def scale(self, index, key):
+        """
+        Scale <key> of an index, adjusted to the draft resolution
+        """
+        return index[key] * self.draft
+
     def set_index(self, party, **kwargs):
         if party.lower() == 'alice':
             index = self.alice_index
@@ -149,8 +628,8 @@ class BB84Setup:
             icons = icons[index['name']]
         center = np.array([0, 0])
         if icons and use_center:
-            center[0] = icons[index[prefix]].width/2
-            center[1] = icons[index[prefix]].height/2
+            center[0] = icons[index[prefix]].width/2 * self.draft
+            center[1] = icons[index[prefix]].height/2 * self.draft
         offset = np.array([0, 0])
         if offsetkey in index and use_offset and offsetkey != 'head_offset':
             offset = np.array(index[offsetkey])
@@ -171,15 +650,15 @@ class BB84Setup:
             txt = sc.Text(str(t), font=self.font_family, size=self.font_size)
             txt = self.set_svg_color(txt, color={'fill': index['tally_color']},
                                      default_color=default_color)
-            txt.moveto(*(bits_position+i*x_shift), index['tally_scale'])
+            txt.moveto(*(bits_position+i*x_shift), self.scale(index, 'tally_scale'))
             array.append(txt)
         x_shift = np.array([index['tally_bases_x_adjust']*self.resolution[0], 0])
         for i, b in enumerate(index['tally_bases']):
-            base = [deepcopy(j) for j in self.activation_icons[index['name']][b]]
-            for component in base:
+            for component in self.activation_icons[index['name']][b]:
                 component = self.set_svg_color(
                     component, color={'stroke': index['tally_color']})
-                component.moveto(*(bases_position+i*x_shift), index['tally_bases_scale'])
+                component.moveto(*(bases_position+i*x_shift),
+                                 self.scale(index, 'tally_bases_scale'))
                 array.append(component)
         return array
 
@@ -202,15 +681,16 @@ class BB84Setup:
         if self.head_icons:
             head = self.set_svg_color(self.head_icons[index['head']],
                                       color={'fill': color})
-            head.moveto(*self.position(index, 'head'), index['head_scale'])
+            head.moveto(*self.position(index, 'head'), self.scale(index, 'head_scale'))
             components.append(head)
         # detector
         detector = self.set_svg_color(self.detector_icons[party][index['detector']],
                                       color={'stroke': detector_color})
-        detector.moveto(*self.position(index, 'detector'), index['detector_scale'])
+        detector.moveto(*self.position(index, 'detector'), self.scale(index, 'detector_scale'))
         detector.rotate(index['detector_rotation'])
         detector.skew(0, -30)
         components.append(detector)
+        self.boxes[party] = [element_box(c) for c in components]
         return sc.Panel(*components)
 
     def setup_alice(self):
@@ -238,45 +718,61 @@ class BB84Setup:
         #                          default_color='black')
         # txt.moveto(*tpos, index['tally_scale'])
         # components.append(txt)
+        self.boxes['tally'] = [element_box(c) for c in components]
         layouts.append(sc.Panel(*components))
         # Bob's tally
         #components.append(detector)
         return layouts
 
-    def setup_signal(self):
-        # signal
+    def signal_placement(self):
+        """
+        Sender, sender index (with the polarisation adjustments), and
+        position and rotation of the signal (empty if not emitted)
+        """
         party = 'alice' if self.alice_index['is_sender'] else 'bob'
-        index = getattr(self, f'{party}_index')
-        other = getattr(self, f'{"bob" if party == "alice" else "alice"}_index')
-        components = []
+        index = dict(getattr(self, f'{party}_index'))
+        other = dict(getattr(self, f'{"bob" if party == "alice" else "alice"}_index'))
+        # polarisation adjustments must not accumulate in the index
+        index['signal_offset'] = list(index['signal_offset'])
+        other['signal_offset'] = list(other['signal_offset'])
+        if not index['is_sender']:
+            return party, index, [], []
+        if index['signal_polarisation'] == 1:
+            index['signal_y_adjust'] *= 1.3
+            index['signal_offset'][0] *= 2/3
+            index['signal_offset'][1] *= 2/3
+        elif index['signal_polarisation'] == 2:
+            index['signal_offset'][0] *= 1.333
+            index['signal_offset'][1] *= 1.083
+            other['signal_offset'][0] /= 2
+            other['signal_offset'][1] /= 2
+            index['signal_y_adjust'] *= 1.2
+        p_signal, rot_signal = \
+            self.signal_lerp(
+                self.position(index, 'signal', use_center=True),
+                self.position(other, 'signal', use_center=True),
+                index['signal_distance'],
+                self.resolution[1]*index['signal_y_adjust'])
+        return party, index, p_signal, rot_signal
+
+    def place_signal(self, party, index, position, rotation):
         signal = self.set_svg_color(self.signal_icons[party][index['signal']],
                                     color={'stroke': self.signal_color})
-        if index['is_sender']:
-            if index['signal_polarisation'] == 1:
-                index['signal_y_adjust'] *= 1.3
-                index['signal_offset'][0] *= 2/3
-                index['signal_offset'][1] *= 2/3
-            elif index['signal_polarisation'] == 2:
-                index['signal_offset'][0] *= 1.333
-                index['signal_offset'][1] *= 1.083
-                other['signal_offset'][0] /= 2
-                other['signal_offset'][1] /= 2
-                index['signal_y_adjust'] *= 1.2
-            p_signal, rot_signal = \
-                self.signal_lerp(
-                    self.position(index, 'signal', use_center=True),
-                    self.position(other, 'signal', use_center=True),
-                    index['signal_distance'],
-                    self.resolution[1]*index['signal_y_adjust'])
-            if list(p_signal):
-                signal.moveto(*p_signal, index['signal_scale'])
-                signal.rotate(*rot_signal)
-                if index['signal_polarisation'] == 1:
-                    signal.skew_x(30)
-                    signal.rotate(10)
-                elif index['signal_polarisation'] == 2:
-                    signal.skew_x(-40)
-                components.append(signal)
+        signal.moveto(*position, self.scale(index, 'signal_scale'))
+        signal.rotate(*rotation)
+        if index['signal_polarisation'] == 1:
+            signal.skew_x(30)
+            signal.rotate(10)
+        elif index['signal_polarisation'] == 2:
+            signal.skew_x(-40)
+        return signal
+
+    def setup_signal(self):
+        # signal
+        party, index, p_signal, rot_signal = self.signal_placement()
+        components = []
+        if list(p_signal):
+            components.append(self.place_signal(party, index, p_signal, rot_signal))
         # lay quantum connection
         # quantum_bridge = sc.Line(
         #     [self.alice_position('signal', use_center=False, use_offset=True),
@@ -284,126 +780,347 @@ class BB84Setup:
         #     width=8,
         #     color=self.public_color)
         # content.append(quantum_bridge)
+        self.boxes['signal'] = [element_box(c) for c in components]
         return sc.Panel(*components)
 
+    def signal_sprite(self, subpixel=4):
+        """
+        Signal layer tiles from a pre-rasterized sprite: the signal only
+        translates along its path (rotation, skew, and scale are fixed
+        per signal and polarisation), so it is rasterized once per
+        sub-pixel phase (in steps of 1/<subpixel> px) and then placed at
+        the integer part of its position
+        """
+        party, index, p_signal, rot_signal = self.signal_placement()
+        if not list(p_signal):
+            return []
+        steps = np.round(np.asarray(p_signal, dtype=float) * subpixel).astype(int)
+        anchor, phase = np.divmod(steps, subpixel)
+        key = ('sprite', self.icon_key(self.signal_icons[party], index['signal']),
+               self.signal_color, self.scale(index, 'signal_scale'),
+               index['signal_polarisation'],
+               freeze(rot_signal), subpixel, *phase.tolist())
+        tiles = self.raster_cache.get(key)
+        if tiles is None:
+            with instrument.span('layer/signal') as args:
+                signal = self.place_signal(party, index, phase / subpixel, rot_signal)
+                x0, y0, x1, y1 = element_box(signal)
+                svg = sc.Figure(str(x1 - x0), str(y1 - y0), sc.Panel(signal).move(-x0, -y0))
+                tiles = self.raster_cache.put(key, [(self.pixelate_svg(svg), x0, y0)])
+                args['bytes'] = tiles[0][0].nbytes
+        ax, ay = anchor.tolist()
+        return [(img, x + ax, y + ay) for img, x, y in tiles]
+
+    def tally_glyph(self, index, kind, value, phase, subpixel=4):
+        """
+        Tiles of a single tally cell, a bit ('bit') or a basis symbol
+        ('basis'), rasterized once per value, color, scale and sub-pixel
+        phase (in steps of 1/<subpixel> px); tile positions are relative
+        to the integer part of the cell position
+        """
+        color = index['tally_color']
+        if kind == 'bit':
+            key = ('glyph', kind, value, color, self.scale(index, 'tally_scale'),
+                   self.font_family, self.font_size, subpixel, *phase)
+        else:
+            key = ('glyph', kind, self.icon_key(self.activation_icons[index['name']], value),
+                   color, self.scale(index, 'tally_bases_scale'), subpixel, *phase)
+        tiles = self.raster_cache.get(key)
+        if tiles is None:
+            position = np.asarray(phase) / subpixel
+            if kind == 'bit':
+                txt = sc.Text(str(value), font=self.font_family, size=self.font_size)
+                components = [self.set_svg_color(txt, color={'fill': color},
+                                                 default_color='black')]
+                scale = self.scale(index, 'tally_scale')
+            else:
+                components = [self.set_svg_color(c, color={'stroke': color})
+                              for c in self.activation_icons[index['name']][value]]
+                scale = self.scale(index, 'tally_bases_scale')
+            for c in components:
+                c.moveto(*position, scale)
+            boxes = np.array([element_box(c) for c in components])
+            x0, y0 = boxes[:, :2].min(axis=0).tolist()
+            x1, y1 = boxes[:, 2:].max(axis=0).tolist()
+            svg = sc.Figure(str(x1 - x0), str(y1 - y0),
+                            sc.Panel(*components).move(-x0, -y0))
+            tiles = self.raster_cache.put(key, [(self.pixelate_svg(svg), x0, y0)])
+        return tiles
+
+    def tally_atlas(self, subpixel=4):
+        """
+        Tally layer tiles drawn from pre-rasterized glyphs (see
+        tally_glyph) onto a canvas kept across frames (see TallyCanvas),
+        so a growing tally only blits its newly appended cells
+        """
+        key = self.layer_key('tally', exclude=('tally', 'tally_bases'))
+        canvas = self.tally_canvases.get(key)
+        if canvas is None:
+            canvas = TallyCanvas(self.resolution)
+            self.tally_canvases[key] = canvas
+            if len(self.tally_canvases) > self.max_tally_canvases:
+                self.tally_canvases.popitem(last=False)
+        self.tally_canvases.move_to_end(key)
+        rows = {}
+        for party in ('alice', 'bob'):
+            index = getattr(self, f'{party}_index')
+            for kind, prefix in [('bit', 'tally'), ('basis', 'tally_bases')]:
+                origin = self.position(index, prefix)
+                shift = index[f'{prefix}_x_adjust'] * self.resolution[0]
+                cells = []
+                for i, value in enumerate(index[prefix]):
+                    steps = np.round((origin + [i*shift, 0]) * subpixel).astype(int)
+                    anchor, phase = np.divmod(steps, subpixel)
+                    cells.append((value, *anchor.tolist(), *phase.tolist()))
+                rows[(party, kind)] = cells
+
+        def tiles(row, cell):
+            party, kind = row
+            value, ax, ay, *phase = cell
+            glyph = self.tally_glyph(getattr(self, f'{party}_index'), kind, value,
+                                     phase, subpixel)
+            return [(img, x + ax, y + ay) for img, x, y in glyph]
+
+        return canvas.update(rows, tiles)
+
+    def layer_key(self, layer, exclude=()):
+        """
+        Cache key of a layer: everything its rasterization depends on
+        (except the index fields in <exclude>); a party's layer only
+        depends on that party's index
+        """
+        key = [layer, freeze(self.resolution), freeze(self.positions),
+               self.font_family, self.font_size, self.signal_color]
+        if self.head_icons:
+            key.append(tuple(self.icon_key(self.head_icons, i)
+                             for i in range(len(self.head_icons))))
+        fields = self.layer_fields.get(layer, ())
+        parties = (layer,) if layer in ('alice', 'bob') else ('alice', 'bob')
+        for party in parties:
+            index = getattr(self, f'{party}_index')
+            key.append(tuple((k, freeze(index[k])) for k in fields if k not in exclude))
+            key.append(getattr(self, f'{party}_color'))
+        if layer in ('alice', 'bob'):
+            index = getattr(self, f'{layer}_index')
+            key.append(self.icon_key(self.detector_icons[layer], index['detector']))
+        elif layer == 'signal':
+            for party in ('alice', 'bob'):
+                index = getattr(self, f'{party}_index')
+                key.append(self.icon_key(self.signal_icons[party], index['signal']))
+        elif layer == 'tally':
+            for party in ('alice', 'bob'):
+                icons = self.activation_icons[party]
+                key.append(tuple(self.icon_key(icons, i) for i in range(len(icons))))
+        return tuple(key)
+
+    @staticmethod
+    def icon_key(icon_list, i):
+        """
+        Identifier of icon <i> in a list of icons (without copying it);
+        registry icons are identified by their registry key, which
+        changes when the asset is re-registered (see IconRegistry.key)
+        """
+        if isinstance(icon_list, IconList):
+            return icon_list.registry.key(icon_list.paths[i])
+        icon = icon_list[i]
+        if isinstance(icon, (list, tuple)):
+            return tuple(BB84Setup.icon_key(icon, j) for j in range(len(icon)))
+        source = getattr(icon, 'source', None)
+        return icons.key(source) if source else icon.tostr()
+
+    def layer_box(self, layer):
+        """
+        Bounding box (x0, y0, x1, y1) of a layer's components clipped to
+        the canvas, the full canvas if the layer recorded no boxes, or
+        None if the layer is empty
+        """
+        width, height = self.resolution
+        if layer not in self.boxes:
+            return 0, 0, width, height
+        boxes = np.array(self.boxes[layer]).reshape(-1, 4)
+        if not len(boxes):
+            return None
+        x0, y0 = max(0, boxes[:, 0].min()), max(0, boxes[:, 1].min())
+        x1, y1 = min(width, boxes[:, 2].max()), min(height, boxes[:, 3].max())
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return int(x0), int(y0), int(x1), int(y1)
+
+    def layer_images(self, layer):
+        """
+        Rasterized tiles (image, x, y) of a layer, i.e. the layer cropped
+        to the bounding box of its components and the box's top-left
+        corner on the canvas; served from the raster cache if none of
+        the layer's inputs changed
+        """
+        if layer == 'signal' and self.sprite_signal:
+            return self.signal_sprite()
+        if layer == 'tally' and self.atlas_tally:
+            return self.tally_atlas()
+        key = self.layer_key(layer)
+        images = self.raster_cache.get(key)
+        if images is not None:
+            return images
+        with instrument.span(f'layer/{layer}') as args:
+            self.boxes.pop(layer, None)
+            with instrument.span(f'setup/{layer}'):
+                layouts = getattr(self, f'setup_{layer}')()
+            if not layouts:
+                layouts = []
+            elif not isinstance(layouts, list):
+                layouts = [layouts]
+            box = self.layer_box(layer)
+            images = []
+            if box is not None:
+                x0, y0, x1, y1 = box
+                for l in layouts:
+                    cropped = sc.Panel(l).move(-x0, -y0)
+                    svg = sc.Figure(str(x1 - x0), str(y1 - y0), cropped)
+                    images.append((self.pixelate_svg(svg, color=None), x0, y0))
+            args['bytes'] = sum(img.nbytes for img, _, _ in images)
+        return self.raster_cache.put(key, images)
+
     def images(self):
-        content = []
-        # build a layout for each party
-        alice_layout = self.setup_alice()
-        bob_layout = self.setup_bob()
-        if alice_layout:
-            alice_svg = sc.Figure(*[str(r) for r in self.resolution], alice_layout)
-            content.append(alice_svg)
-        if bob_layout:
-            bob_svg = sc.Figure(*[str(r) for r in self.resolution], bob_layout)
-            content.append(bob_svg)
-        # add the adversary
-        eve_layout = self.setup_eve()
-        if eve_layout:
-            eve_svg = sc.Figure(*[str(r) for r in self.resolution], eve_layout)
-            content.append(eve_svg)
-        # add tallies for both parties
-        tally_layout = self.setup_tally()
-        if tally_layout:
-            tally_svg = [sc.Figure(*[str(r) for r in self.resolution], t) for t in tally_layout]
-            content += tally_svg
-        # signal between the parties
-        signal_layout = self.setup_signal()
-        if signal_layout:
-            signal_svg = sc.Figure(*[str(r) for r in self.resolution], signal_layout)
-            content.append(signal_svg)
-        # stack layers for a scenario 
-        figures = [sc.Figure(*[str(r) for r in self.resolution], c) for c in content]
+        # stack layers for a scenario (the signal layer last)
         try:
-            return [self.pixelate_svg(svg, color=None) for svg in figures]
+            return [img for layer in self.layers for img in self.layer_images(layer)]
         except cairocffi.CairoError:
             return []
 
     def image_tally(self):
-        content = []
-        # add tallies for both parties
-        tally_layout = self.setup_tally()
-        if tally_layout:
-            tally_svg = [sc.Figure(*[str(r) for r in self.resolution], t) for t in tally_layout]
-            content += tally_svg
-        # stack layers for a scenario
-        figures = [sc.Figure(*[str(r) for r in self.resolution], c) for c in content]
         try:
-            return [self.pixelate_svg(svg, color=None) for svg in figures]
+            return self.layer_images('tally')
         except cairocffi.CairoError:
             return []
 
+    def composite(self, out=None):
+        """
+        Alpha-composite all layer tiles into a premultiplied ARGB32
+        buffer; the signal layer is faded by the sender's signal_alpha
+
+        Args:
+          out (np.ndarray): optional preallocated (h, w, 4) uint8 buffer
+        """
+        if out is None:
+            out = np.zeros((self.resolution[1], self.resolution[0], 4), dtype=np.uint8)
+        else:
+            out[...] = 0
+        party = 'alice' if self.alice_index['is_sender'] else 'bob'
+        index = getattr(self, f'{party}_index')
+        try:
+            for layer in self.layers:
+                alpha = index['signal_alpha'] if layer == 'signal' else 1.
+                tiles = self.layer_images(layer)
+                with instrument.span(f'composite/{layer}'):
+                    for img, x, y in tiles:
+                        composite(out, img, alpha=alpha, x=x, y=y)
+        except cairocffi.CairoError:
+            pass
+        return out
+
+    def render(self, out=None):
+        """
+        Composited frame as a straight-alpha RGBA uint8 array
+        """
+        out = self.composite(out)
+        with instrument.span('unpremultiply'):
+            return to_rgba(out, out=out)
+
+    def save(self, filename, out=None, compress_level=6):
+        """
+        Render the frame and write it as PNG without going through
+        matplotlib; returns the frame buffer for reuse
+
+        Args:
+          filename (str | Path): output file
+          out (np.ndarray): optional preallocated (h, w, 4) uint8 buffer
+          compress_level (int): zlib compression level of the PNG
+        """
+        out = self.render(out)
+        with instrument.span('write'):
+            Image.fromarray(out).save(filename, compress_level=compress_level)
+        return out
+
     def plot(self):
-        svgs = self.images()
-        if not svgs:
-            return svgs
         images = []
-        for svg in svgs[:-1]:
-            img = plt.imshow(svg)
-            images.append(img)
         party = 'alice' if self.alice_index['is_sender'] else 'bob'
         index = getattr(self, f'{party}_index')
-        img = plt.imshow(svgs[-1], alpha=index['signal_alpha'])
-        images.append(img)
+        for layer in self.layers:
+            alpha = index['signal_alpha'] if layer == 'signal' else 1.
+            images += self.plot_tiles(self.layer_images(layer), alpha=alpha)
         return images
 
     def plot_tally(self):
-        svgs = self.image_tally()
-        if not svgs:
-            return svgs
+        return self.plot_tiles(self.image_tally())
+
+    def plot_tiles(self, tiles, alpha=1.):
         images = []
-        for svg in svgs:
-            img = plt.imshow(svg)
-            images.append(img)
+        for img, x, y in tiles:
+            extent = (x, x + img.shape[1], y + img.shape[0], y)
+            images.append(plt.imshow(to_rgba(img), alpha=alpha, extent=extent))
+        plt.xlim(0, self.resolution[0])
+        plt.ylim(self.resolution[1], 0)
         return images
 
     @staticmethod
     def set_svg_color(svgobj, color=None, default_color=default_color):
+        """
+        A copy of <svgobj> with <default_color> replaced by <color>
+        (dict mapping 'fill'/'stroke' to a color); <svgobj> is left
+        untouched.  Registry icons (with a <source>) are taken to be
+        unmodified copies of their asset, and come from the registry's
+        memoized variants
+        """
         if color is None:
             color = {}
-        for key in color:
-            for e in svgobj.root.iter():
-                style = e.get(key)
-                if style == default_color.lower():
-                    e.set(key, color[key].lower())
-                style = e.get('style')
-                if style and key in style:
-                    e.set('style', style.replace(f'{key}: {default_color.lower()}',
-                                                 f'{key}: {color[key].lower()}'))
-        return svgobj
+        source = getattr(svgobj, 'source', None)
+        if source is not None:
+            return icons.variant(source, color, default_color)
+        svgobj = deepcopy(svgobj)
+        return recolor(svgobj, color_index(svgobj, default_color), color, default_color)
 
     @staticmethod
     def pixelate_svg(svgobj, color=None, default_color=default_color):
-        png = cairosvg.svg2png(svgobj.tostr())
-        return Image.open(BytesIO(png))
+        """
+        Rasterize an SVG straight into a cairo image surface whose pixel
+        buffer is a NumPy array (premultiplied ARGB32, see CAIRO_RGBA)
+        """
+        with instrument.span('tostr'):
+            bytestring = svgobj.tostr()
+        with instrument.span('rasterize') as args:
+            surface = ArraySurface(Tree(bytestring=bytestring), None, 96)
+            surface.finish()
+            args['bytes'] = surface.array.nbytes
+        return surface.array
 
     @staticmethod
     def load_detector_svgs(base_dir=None):
         if base_dir is None:
             base_dir = Path(".")
-        detectors = [sc.SVG(base_dir / f"detector{i}.svg") for i in range(32)]
+        detectors = IconList([base_dir / f"detector{i}.svg"
+                              for i in range(BB84Setup.detector_variants)])
         return detectors
 
     @staticmethod
     def load_activation_svgs(base_dir=None):
         if base_dir is None:
             base_dir = Path(".")
-        activations = [[sc.SVG(base_dir / f"activation{i}_{j}.svg")
-                        for j in range(1, 5)] for i in range(2)]
+        activations = IconList([[base_dir / f"activation{i}_{j}.svg"
+                                 for j in range(1, 5)] for i in range(2)])
         return activations
 
     @staticmethod
     def load_signal_svgs(base_dir=None):
         if base_dir is None:
             base_dir = Path(".")
-        signals = [sc.SVG(base_dir / f"wave{i}.svg") for i in range(4)]
+        signals = IconList([base_dir / f"wave{i}.svg" for i in range(4)])
         return signals
 
 
 if __name__ == "__main__":
     img_base = Path("assets/images")
-    layout = BB84Setup(head_icons=[sc.SVG(img_base/"alice_text.svg"),
-                                   sc.SVG(img_base/"bob_text.svg")])
+    layout = BB84Setup(head_icons=[icons.get(img_base/"alice_text.svg"),
+                                   icons.get(img_base/"bob_text.svg")])
     layout.set_index('alice', detector=0,
                      signal_distance=0.0, signal_alpha=1.0,
                      signal_polarisation=2,
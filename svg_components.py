@@ -1,32 +1,37 @@
+import re
+from pathlib import Path
 import numpy as np
-import matplotlib.pyplot as plt
 
 P2 = np.pi/2
 
+# the SVGs reproduce the geometry of the original matplotlib figures:
+# 72 user units (pt) per inch and the default subplot box of a figure
+# as (left, bottom, width, height) fractions, with y pointing up
+PT_PER_INCH = 72
+AXES_BOX = (0.125, 0.11, 0.775, 0.77)
+
 
 def wave_packet(*pars, N=500, from_=-1, to_=1):
-    pars = list(pars)
+    """
+    Gaussian envelope times a sine times a cosine; a factor whose
+    parameters (amplitude, frequency/width, phase/center) are all zero
+    is left out.  Each parameter triplet may also be an (n, 3) array of
+    variants, which gives an (n, N) array of packets.
+    """
     t = np.linspace(from_, to_, N)
-    ga, gb, gc = pars.pop(0)
-    sa, sb, sc = pars.pop(0)
-    ca, cb, cc = pars.pop(0)
-    if ga == gb == gc == 0:
-        gauss = np.ones_like(t)
-    else:
-        gauss = ga * np.exp(-0.5*(t-gc)**2/gb**2)
-    if sa == sb == sc == 0:
-        sin = np.ones_like(t)
-    else:
-        sin = sa * np.sin(sc + sb*t)
-    if ca == cb == cc == 0:
-        cos = np.ones_like(t)
-    else:
-        cos = ca * np.cos(cc + cb*t)
+    (ga, gb, gc), (sa, sb, sc), (ca, cb, cc) = [
+        np.moveaxis(np.asarray(p, dtype=float), -1, 0)[..., None] for p in pars[:3]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gauss = np.where((ga == 0) & (gb == 0) & (gc == 0),
+                         1., ga * np.exp(-0.5*(t-gc)**2/gb**2))
+    sin = np.where((sa == 0) & (sb == 0) & (sc == 0), 1., sa * np.sin(sc + sb*t))
+    cos = np.where((ca == 0) & (cb == 0) & (cc == 0), 1., ca * np.cos(cc + cb*t))
     return t, gauss * sin * cos
 
 
 def plt_detector(cx=0, cy=0, r=1.0, theta=0,
                  mask=[1, 1, 1, 1, 1], pltkw={}):
+    import matplotlib.pyplot as plt
     p11, p12 = r+0j, -r+0j
     p21, p22 = r*1j, -r*1j
     if theta:
@@ -46,50 +51,143 @@ def plt_detector(cx=0, cy=0, r=1.0, theta=0,
         plt.gca().add_patch(circ)
 
 
-def svg_wave_variants(N=500, from_=-1, to_=1,
-                      figsize=(5, 5), color='#fff', lw=4):
-    kw = {'c': color, 'lw': lw, 'solid_capstyle': 'round'}
-    for i, (pars1, pars2, pars3) in enumerate(zip(
-            [ (1, 0.3,  0),  (1, 0.4,  0),  (1, 0.5, 0),  (1, 0.4,  0) ],
-            [ (1,  50, P2),  (1,  18, P2),  (1,   3, 0),  (1, 4.8, P2) ],
-            [ (0,   0,  0),  (1,  80,  0),  (1,  60, 0),  (1,  65,  0) ])):
-        t, wave = wave_packet(pars1, pars2, pars3,
-                              N=N, from_=from_, to_=to_)
-        plt.figure(figsize=figsize)
-        plt.plot(t, wave, **kw)
-        plt.axis('off')
-        plt.savefig(f'assets/images/wave{i}.svg', format='svg', transparent=True)
-        plt.show()
-
-
-def svg_detector_variants(figsize=(5, 5), color='#fff', lw=4):
-    kw = {'c': color, 'lw': lw, 'solid_capstyle': 'round'}
-    for i, (r_i, theta_i) in enumerate(zip(
-            [0.7]*32, [0, P2/2]+list(np.linspace(0, P2/2, 30)))):
-        # plot entire detector sign
-        plt.figure(figsize=figsize)
-        plt_detector(0, 0, r_i, theta_i, pltkw=kw)
-        plt.xlim(-1.1*r_i, 1.1*r_i)
-        plt.ylim(-1.1*r_i, 1.1*r_i)
-        plt.axis('off')
-        plt.savefig(f'assets/images/detector{i}.svg', format='svg', transparent=True)
-        plt.show()
-        mask = 16
-        # plot individual internal components
-        if i >= 2:
-            continue
+def hex_color(color):
+    """
+    Lower-case 6-digit hex color ('#fff' -> '#ffffff')
+    """
+    color = color.lower().lstrip('#')
+    if len(color) == 3:
+        color = ''.join(2*c for c in color)
+    return f'#{color}'
+
+
+def to_svg(x, y, xlim, ylim, figsize=(5, 5)):
+    """
+    SVG coordinates of data coordinates in axes with limits <xlim> and
+    <ylim> (arrays broadcast, e.g. one limit per variant)
+    """
+    w, h = PT_PER_INCH * np.asarray(figsize, dtype=float)
+    left, bottom, width, height = AXES_BOX
+    (x0, x1), (y0, y1) = xlim, ylim
+    X = w * (left + width * (x - x0) / (x1 - x0))
+    Y = h * (1 - bottom - height * (y - y0) / (y1 - y0))
+    return X, Y
+
+
+def path_data(X, Y):
+    points = " L ".join(f"{x:.2f} {y:.2f}" for x, y in zip(X, Y))
+    return f"M {points}"
+
+
+def svg_document(elements, figsize=(5, 5), color='#fff', lw=4):
+    """
+    Minimal SVG of stroked elements; the stroke color is set as an
+    attribute so that BB84Setup.set_svg_color can replace it
+    """
+    w, h = [f"{v:g}" for v in PT_PER_INCH * np.asarray(figsize, dtype=float)]
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+            f'width="{w}pt" height="{h}pt" viewBox="0 0 {w} {h}">'
+            f'<g fill="none" stroke="{hex_color(color)}" stroke-width="{lw:g}" '
+            f'stroke-linecap="round">{"".join(elements)}</g></svg>')
+
+
+def wave_svgs(N=500, from_=-1, to_=1, figsize=(5, 5), color='#fff', lw=4):
+    """
+    SVGs of the wave packet variants (wave{i}), all variants computed at once
+
+    Returns:
+      dict(str, str): SVG text by icon name
+    """
+    gauss = [(1, 0.3,  0),  (1, 0.4,  0),  (1, 0.5, 0),  (1, 0.4,  0)]
+    sin = [(1,  50, P2),  (1,  18, P2),  (1,   3, 0),  (1, 4.8, P2)]
+    cos = [(0,   0,  0),  (1,  80,  0),  (1,  60, 0),  (1,  65,  0)]
+    t, waves = wave_packet(gauss, sin, cos, N=N, from_=from_, to_=to_)
+    # autoscaled limits with 5% margins
+    xlim = np.array([from_, to_]) + 0.05 * (to_ - from_) * np.array([-1, 1])
+    lo, hi = waves.min(axis=1, keepdims=True), waves.max(axis=1, keepdims=True)
+    ylim = (lo - 0.05 * (hi - lo), hi + 0.05 * (hi - lo))
+    X, Y = to_svg(t, waves, xlim, ylim, figsize)
+    return {f'wave{i}': svg_document([f'<path d="{path_data(X, y)}"/>'],
+                                     figsize, color, lw)
+            for i, y in enumerate(Y)}
+
+
+def detector_angles(n=32):
+    """
+    Rotation of the detector variants: the upright and the diagonal
+    detector, followed by <n>-2 steps of the transition between them
+    """
+    return np.concatenate([[0, P2/2], np.linspace(0, P2/2, n - 2)])
+
+
+def detector_svgs(n=32, figsize=(5, 5), color='#fff', lw=4, r=0.7):
+    """
+    SVGs of <n> detector variants (detector{i}, circle and cross) and of
+    the four cross arms of the first two (activation{i}_{j}), all
+    variants computed at once
+
+    Returns:
+      dict(str, str): SVG text by icon name
+    """
+    theta = detector_angles(n)
+    lim = (-1.1*r, 1.1*r)
+    rot = np.exp(1j*theta)[:, None]
+    # arms from/to the center in plt_detector's order
+    tips = r * rot * np.array([1, -1, 1j, -1j])
+    arms = np.stack([np.where([1, 0, 1, 0], tips, 0),
+                     np.where([1, 0, 1, 0], 0, tips)], axis=-1)
+    X, Y = to_svg(arms.real, arms.imag, lim, lim, figsize)
+    lines = [[f'<path d="{path_data(X[i, k], Y[i, k])}"/>' for k in range(4)]
+             for i in range(n)]
+    cx, cy = to_svg(0, 0, lim, lim, figsize)
+    rx, ry = np.abs(np.subtract(to_svg(r, r, lim, lim, figsize), (cx, cy)))
+    circle = f'<ellipse cx="{cx:.3f}" cy="{cy:.3f}" rx="{rx:.3f}" ry="{ry:.3f}"/>'
+    svgs = {}
+    for i in range(n):
+        svgs[f'detector{i}'] = svg_document([circle] + lines[i], figsize, color, lw)
+    for i in range(min(n, 2)):
         for j in range(1, 5):
-            plt.figure(figsize=figsize)
-            mask = mask >> 1
-            plt_detector(0, 0, r_i, theta_i,
-                         mask=f'{int(bin(mask)[2:]):05d}',
-                         pltkw=kw)
-            plt.xlim(-1.1*r_i, 1.1*r_i)
-            plt.ylim(-1.1*r_i, 1.1*r_i)
-            plt.axis('off')
-            plt.savefig(f'assets/images/activation{i}_{j}.svg',
-                        format='svg', transparent=True)
-            plt.show()
+            svgs[f'activation{i}_{j}'] = svg_document([lines[i][j-1]], figsize, color, lw)
+    return svgs
+
+
+def write_svgs(svgs, out_dir=Path('assets/images')):
+    out_dir = Path(out_dir)
+    for name, text in svgs.items():
+        (out_dir / f'{name}.svg').write_text(text)
+
+
+def register_svgs(svgs, base_dir=Path('assets/images'), registry=None):
+    """
+    In-memory mode: hand the SVGs to the icon registry (see
+    layout.IconRegistry.add) under the paths BB84Setup loads them from,
+    without touching the disk; the number of detector variants among
+    them becomes BB84Setup.detector_variants.  anim.render_scene passes
+    the registered SVGs on to its render processes.
+    """
+    from layout import BB84Setup
+    if registry is None:
+        from layout import icons as registry
+    for name, text in svgs.items():
+        registry.add(Path(base_dir) / f'{name}.svg', text)
+    n = sum(re.fullmatch(r'detector\d+', name) is not None for name in svgs)
+    if n:
+        BB84Setup.detector_variants = n
+
+
+def svg_wave_variants(N=500, from_=-1, to_=1,
+                      figsize=(5, 5), color='#fff', lw=4,
+                      out_dir=Path('assets/images')):
+    write_svgs(wave_svgs(N, from_, to_, figsize, color, lw), out_dir)
+
+
+def svg_detector_variants(figsize=(5, 5), color='#fff', lw=4,
+                          out_dir=Path('assets/images'), n=32):
+    """
+    Write <n> detector variants; for n != 32, set
+    layout.BB84Setup.detector_variants to match when rendering
+    """
+    write_svgs(detector_svgs(n, figsize, color, lw), out_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+import os
+from pathlib import Path
+from itertools import product
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import bb84
+
+
+def grid(**axes):
+    """
+    Cartesian product of parameter axes, e.g.
+      grid(n=[10**6], distance=[0, 50, 100], eve_fraction=[0, 0.5])
+
+    Returns:
+      list(dict): one parameter dict per grid point
+    """
+    keys = list(axes.keys())
+    return [dict(zip(keys, values)) for values in product(*axes.values())]
+
+
+def simulate(point, seed):
+    """
+    A single streamed BB84 run (see bb84.key_stream) for a grid point
+
+    Args:
+      point (dict): parameters n, distance, depolarisation, eve_fraction,
+                    and optionally any other keyword of bb84.channel
+      seed (np.random.SeedSequence | int): seed of this run
+
+    Returns:
+      dict: scalar results of the run
+    """
+    point = dict(point)
+    n = int(point.pop('n', 10**6))
+    eve_fraction = point.pop('eve_fraction', 0)
+    rng = np.random.default_rng(seed)
+    eve = partial(bb84.intercept, strategy='partial',
+                  fraction=eve_fraction) if eve_fraction else None
+    channel = partial(bb84.channel, **point)
+    stats = {}
+    for _, _, stats in bb84.key_stream(n, rng=rng, eve=eve, channel=channel):
+        pass
+    qber = stats.get('qber', 0.)
+    secret_fraction = max(0., 1 - 2*bb84.binary_entropy(qber))
+    qber_lo, qber_hi = stats.get('qber_bounds', (0., 1.))
+    return {
+        'n_detected': stats.get('n_detected', 0),
+        'n_sifted': stats.get('n_sifted', 0),
+        'n_key': stats.get('n_key', 0),
+        'qber': qber,
+        'qber_lo': qber_lo,
+        'qber_hi': qber_hi,
+        'key_rate': stats.get('n_sifted', 0) / n * secret_fraction,
+    }
+
+
+def load_results(filename):
+    """
+    Load the columns of a (partial) sweep file
+
+    Returns:
+      dict(str, np.ndarray): columns, empty if the file does not exist
+    """
+    filename = Path(filename)
+    if not filename.exists():
+        return {}
+    with np.load(filename) as data:
+        return {k: data[k] for k in data.files}
+
+
+def save_results(filename, points, results):
+    """
+    Write finished grid points as one column per parameter and result,
+    plus the grid 'index' column; the file is replaced atomically
+    """
+    filename = Path(filename)
+    indices = sorted(results)
+    columns = {'index': np.array(indices, dtype=np.int64)}
+    for key in points[0]:
+        columns[key] = np.array([points[i][key] for i in indices])
+    for key in results[indices[0]]:
+        columns[key] = np.array([results[i][key] for i in indices])
+    tmp = filename.with_name(filename.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(tmp, filename)
+
+
+def run_sweep(points, filename, seed=0, processes=None, checkpoint=16):
+    """
+    Run BB84 simulations for all grid points on a process pool
+
+    Every grid point i gets the i-th child of SeedSequence(seed).spawn,
+    so its result does not depend on scheduling or on which points were
+    computed in an earlier (interrupted) run.  Points already in
+    <filename> are skipped; progress is saved every <checkpoint> points.
+
+    Args:
+      points (list(dict)): grid points (see grid)
+      filename (str | Path): columnar .npz output
+      seed (int): root seed of the sweep
+      processes (int): number of worker processes (default: all cores)
+      checkpoint (int): number of points between saves
+
+    Returns:
+      dict(str, np.ndarray): the columns of all finished points
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    results = {}
+    columns = load_results(filename)
+    for row, i in enumerate(columns.get('index', [])):
+        i = int(i)
+        if any(columns[k][row] != v for k, v in points[i].items()):
+            raise ValueError(f"{filename} was written for a different grid (point {i})")
+        results[i] = {k: columns[k][row].item() for k in columns
+                      if k != 'index' and k not in points[i]}
+    pending = [i for i in range(len(points)) if i not in results]
+    with ProcessPoolExecutor(processes) as pool:
+        futures = {pool.submit(simulate, points[i], seeds[i]): i for i in pending}
+        for count, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if count % checkpoint == 0:
+                save_results(filename, points, results)
+    if results:
+        save_results(filename, points, results)
+    return load_results(filename)
+
+
+if __name__ == "__main__":
+    points = grid(n=[10**6],
+                  distance=np.linspace(0, 200, 21),
+                  depolarisation=[0., 0.02, 0.05],
+                  eve_fraction=[0., 0.25, 0.5],
+                  efficiency=[0.5],
+                  dark_count=[1e-6])
+    columns = run_sweep(points, "sweep.npz", seed=42)
+    for i in np.argsort(columns['index']):
+        print(f"{columns['distance'][i]:6.1f} km  "
+              f"depol {columns['depolarisation'][i]:.2f}  "
+              f"eve {columns['eve_fraction'][i]:.2f}  "
+              f"QBER {columns['qber'][i]:.4f}  "
+              f"rate {columns['key_rate'][i]:.3e}")
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import bb84
+
+
+def dense_toeplitz(seed, n, out_len):
+    """Toeplitz matrix T[i, j] = t[i - j + n - 1] as in toeplitz_hash"""
+    t = np.random.default_rng(seed).integers(0, 2, size=n + out_len - 1, dtype=np.uint8)
+    i, j = np.indices((out_len, n))
+    return t[i - j + n - 1]
+
+
+@pytest.mark.parametrize("n, out_len, block", [(1, 1, 4), (37, 20, 8), (200, 64, 16),
+                                               (500, 500, 1 << 22)])
+def test_toeplitz_hash_matches_dense_product(n, out_len, block):
+    bits = np.random.default_rng(n).integers(0, 2, size=n, dtype=np.uint8)
+    expected = dense_toeplitz(7, n, out_len).astype(np.int64) @ bits % 2
+    result = bb84.toeplitz_hash(bb84.pack_bits(bits), n, out_len, seed=7, block=block)
+    np.testing.assert_array_equal(bb84.unpack_bits(result, out_len), expected)
+
+
+@pytest.mark.parametrize("n", [1, 63, 64, 65, 300])
+def test_parity_index_matches_brute_force(n):
+    bits = np.random.default_rng(n).integers(0, 2, size=n, dtype=np.uint8)
+    index = bb84.ParityIndex(bb84.as_words(bb84.pack_bits(bits), n))
+    starts, stops = np.triu_indices(n + 1)
+    expected = [bits[a:b].sum() % 2 for a, b in zip(starts, stops)]
+    np.testing.assert_array_equal(index.parity(starts, stops), expected)
+
+
+def test_cascade_corrects_errors():
+    rng = np.random.default_rng(0)
+    n = 10000
+    bits_a = rng.integers(0, 2, size=n, dtype=np.uint8)
+    bits_b = bits_a ^ (rng.random(n) < 0.02)
+    key_b, stats = bb84.cascade(bb84.pack_bits(bits_a), bb84.pack_bits(bits_b),
+                                n, 0.02, rng=1)
+    assert stats['residual_errors'] == 0
+    np.testing.assert_array_equal(bb84.unpack_bits(key_b, n), bits_a)
+
+
+def test_empty_key():
+    empty = bb84.pack_bits([])
+    key_b, stats = bb84.cascade(empty, empty, 0, 0.05, rng=0)
+    assert len(key_b) == 0 and stats['leaked'] == 0
+    final, stats = bb84.privacy_amplification(empty, 0, 0.05, seed=0)
+    assert len(final) == 0 and stats['n_key'] == 0
+
+
+def test_unknown_backend():
+    message = bb84.bb84_encode([0, 1], [1, 0], backend='numpy')
+    with pytest.raises(ValueError):
+        bb84.measure_key(message, [1, 0], backend='cirq')